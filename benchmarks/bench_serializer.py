@@ -0,0 +1,78 @@
+"""
+Compare the time taken by each JSON serializer to encode a bulk request body
+of Movie-like documents, and to decode a bulk response.
+
+Run with:
+
+    python benchmarks/bench_serializer.py [number of documents]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import sys
+import timeit
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from elasticsearch.serializer import JSONSerializer as DefaultSerializer
+
+from pyramid_es.bulk import BulkAction, chunk_actions
+from pyramid_es.serializer import JSONSerializer, OrjsonSerializer
+
+
+def make_actions(n):
+    return [BulkAction('index', 'Movie', uuid.uuid4().hex, doc={
+        'title': 'Movie number %d' % i,
+        'director': 'Director %d' % (i % 100),
+        'year': 1920 + i % 90,
+        'rating': Decimal('%d.%d' % (i % 10, i % 7)),
+        'released': date(1920 + i % 90, 1 + i % 12, 1 + i % 28),
+        'updated': datetime(2015, 1, 1, i % 24, i % 60),
+        'genre_title': 'Genre %d' % (i % 20),
+        'summary': 'Lorem ipsum dolor sit amet. ' * 20,
+    }) for i in range(n)]
+
+
+def make_response(n):
+    return DefaultSerializer().dumps({
+        'took': 30, 'errors': False,
+        'items': [{'index': {'_index': 'movies', '_type': 'Movie',
+                             '_id': uuid.uuid4().hex, '_version': 1,
+                             'status': 201}}
+                  for i in range(n)]})
+
+
+def bench(serializer, actions, response, repeat=5):
+    def encode():
+        for chunk, body in chunk_actions(actions, 'movies', serializer.dumps):
+            pass
+
+    def decode():
+        serializer.loads(response)
+
+    return (min(timeit.repeat(encode, number=1, repeat=repeat)),
+            min(timeit.repeat(decode, number=1, repeat=repeat)))
+
+
+def main(argv=sys.argv):
+    n = int(argv[1]) if len(argv) > 1 else 10000
+    actions = make_actions(n)
+    response = make_response(n)
+
+    serializers = [('elasticsearch default', DefaultSerializer()),
+                   ('pyramid_es JSONSerializer', JSONSerializer())]
+    try:
+        serializers.append(('pyramid_es OrjsonSerializer',
+                            OrjsonSerializer()))
+    except ImportError:
+        pass
+
+    print('%d documents' % n)
+    print('%-30s %12s %12s' % ('serializer', 'encode (ms)', 'decode (ms)'))
+    for name, serializer in serializers:
+        encode, decode = bench(serializer, actions, response)
+        print('%-30s %12.1f %12.1f' % (name, encode * 1000, decode * 1000))
+
+
+if __name__ == '__main__':
+    main()
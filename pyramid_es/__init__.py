@@ -1,13 +1,32 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from pyramid.settings import asbool
+from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool, aslist
 
+from .bulk import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_CHUNK_BYTES
 from .client import ElasticClient
+from .hashcache import LRUHashCache, ShelveHashCache
 
 
 __version__ = '0.3.2.dev'
 
 
+# Settings passed on to the Elasticsearch transport and connections, with
+# functions to convert them from strings.
+_TRANSPORT_SETTINGS = [
+    ('maxsize', int),
+    ('pool_block', asbool),
+    ('keep_alive', asbool),
+    ('compress', asbool),
+    ('max_retries', int),
+    ('retry_on_timeout', asbool),
+    ('sniff_on_start', asbool),
+    ('sniff_on_connection_fail', asbool),
+    ('sniffer_timeout', float),
+    ('sniff_timeout', float),
+]
+
+
 def client_from_config(settings, prefix='elastic.'):
     """
     Instantiate and configure an Elasticsearch from settings.
@@ -16,12 +35,44 @@ def client_from_config(settings, prefix='elastic.'):
     include ``pyramid_es`` and use the :py:func:`get_client` function to get
     access to the shared :py:class:`.client.ElasticClient` instance.
     """
+    hash_cache = None
+    if settings.get(prefix + 'hash_cache_path'):
+        hash_cache = ShelveHashCache(settings[prefix + 'hash_cache_path'])
+    elif settings.get(prefix + 'hash_cache_size'):
+        hash_cache = LRUHashCache(int(settings[prefix + 'hash_cache_size']))
+
+    transport_options = {}
+    for name, convert in _TRANSPORT_SETTINGS:
+        if settings.get(prefix + name) is not None:
+            transport_options[name] = convert(settings[prefix + name])
+
+    serializer = DottedNameResolver().maybe_resolve(
+        settings.get(prefix + 'serializer'))
+    if isinstance(serializer, type):
+        serializer = serializer()
+
     return ElasticClient(
-        servers=settings.get(prefix + 'servers', ['localhost:9200']),
-        timeout=settings.get(prefix + 'timeout', 1.0),
+        servers=aslist(settings.get(prefix + 'servers', ['localhost:9200'])),
+        timeout=float(settings.get(prefix + 'timeout', 10.0)),
         index=settings[prefix + 'index'],
         use_transaction=asbool(settings.get(prefix + 'use_transaction', True)),
-        disable_indexing=settings.get(prefix + 'disable_indexing', False))
+        disable_indexing=settings.get(prefix + 'disable_indexing', False),
+        bulk_chunk_size=int(settings.get(prefix + 'bulk_chunk_size',
+                                         DEFAULT_CHUNK_SIZE)),
+        bulk_max_chunk_bytes=int(settings.get(prefix + 'bulk_max_chunk_bytes',
+                                              DEFAULT_MAX_CHUNK_BYTES)),
+        background=asbool(settings.get(prefix + 'background', False)),
+        background_workers=int(settings.get(prefix + 'background_workers',
+                                            1)),
+        background_max_pending=int(
+            settings.get(prefix + 'background_max_pending', 10)),
+        spool_threshold=int(settings.get(prefix + 'spool_threshold', 0)),
+        spool_dir=settings.get(prefix + 'spool_dir'),
+        hash_cache=hash_cache,
+        serializer=serializer,
+        transport_options=transport_options,
+        warm_up_after_fork=asbool(settings.get(prefix + 'warm_up_after_fork',
+                                               False)))
 
 
 def includeme(config):
@@ -29,8 +80,17 @@ def includeme(config):
     settings = registry.settings
 
     client = client_from_config(settings)
-    if asbool(settings.get('elastic.ensure_index_on_start')):
+    ensure_index = asbool(settings.get('elastic.ensure_index_on_start'))
+    sync_base = settings.get('elastic.sync_mappings_on_start')
+    if ensure_index:
         client.ensure_index()
+    if sync_base:
+        client.sync_mappings(
+            DottedNameResolver().maybe_resolve(sync_base),
+            workers=int(settings.get('elastic.sync_mappings_workers', 4)))
+    if ensure_index or sync_base:
+        # Don't leave connections open to be inherited by forked workers.
+        client.close()
 
     registry.pyramid_es_client = client
 
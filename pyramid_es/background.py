@@ -0,0 +1,127 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+A worker pool to send committed writes to Elasticsearch outside of the request
+that committed them.
+"""
+import atexit
+import logging
+import os
+import threading
+import weakref
+
+from six.moves.queue import Queue
+
+log = logging.getLogger(__name__)
+
+
+_STOP = object()
+
+# Indexers with running workers, so that their pending batches can be sent at
+# exit. A single exit handler is registered rather than one per indexer, which
+# would keep every indexer ever started alive until exit.
+_running = weakref.WeakSet()
+
+
+def _shutdown_all():
+    for indexer in list(_running):
+        indexer.shutdown()
+
+
+atexit.register(_shutdown_all)
+
+
+class BackgroundIndexer(object):
+    """
+    Sends batches of :py:class:`.bulk.BulkAction` instances with a client's
+    bulk API from a pool of worker threads.
+
+    At most ``max_pending`` batches can be waiting to be sent: once that many
+    are waiting, :py:meth:`submit` blocks until a worker catches up. Batches
+    still waiting when the interpreter exits are sent before it does.
+
+    Failures are passed to ``on_error(actions, exc)`` if supplied, otherwise
+    they are logged.
+
+    Worker threads don't survive a fork, so in a forked child process, new
+    ones are started with an empty queue on the first :py:meth:`submit`.
+    """
+
+    def __init__(self, client, workers=1, max_pending=10, on_error=None):
+        self.client = client
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self._reset()
+
+    def _reset(self):
+        self.queue = Queue(self.max_pending)
+        self.threads = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def start(self):
+        """
+        Start the worker threads, if they aren't already running.
+        """
+        with self._lock:
+            if self.threads:
+                return
+            for n in range(self.workers):
+                t = threading.Thread(target=self._run, args=(self.queue,),
+                                     name='pyramid_es-indexer-%d' % n)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+            _running.add(self)
+
+    def submit(self, actions, timeout=None):
+        """
+        Queue a batch of actions to be sent. Blocks while the queue is full,
+        for at most ``timeout`` seconds if that is given.
+
+        ``actions`` can be any iterable, which won't be consumed until a worker
+        sends it, so it must not be modified afterwards.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        if not self.threads:
+            self.start()
+        self.queue.put(actions, timeout=timeout)
+
+    def join(self):
+        """
+        Block until every submitted batch has been sent.
+        """
+        self.queue.join()
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once the batches already submitted have been
+        sent. If ``wait`` is true, block until that is done.
+        """
+        with self._lock:
+            threads, self.threads = self.threads, []
+            _running.discard(self)
+        for t in threads:
+            self.queue.put(_STOP)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _run(self, queue):
+        # Workers stay with the queue they were started for, which is replaced
+        # by _reset().
+        while True:
+            actions = queue.get()
+            try:
+                if actions is _STOP:
+                    return
+                self.client.bulk(actions)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(actions, e)
+                else:
+                    log.exception('Failed to send bulk actions')
+            finally:
+                queue.task_done()
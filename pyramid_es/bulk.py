@@ -0,0 +1,348 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+Utilities for batching index and delete operations into requests against the
+Elasticsearch ``_bulk`` API.
+"""
+import logging
+import tempfile
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+
+class BulkError(Exception):
+    """
+    Raised when one or more actions submitted through the bulk API failed.
+
+    The ``errors`` attribute is a list of dicts, one per failed action, with
+    the keys ``op_type``, ``doc_type``, ``id``, ``status`` and ``error``.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        Exception.__init__(self, '%d bulk action(s) failed' % len(errors))
+
+
+class BulkAction(object):
+    """
+    A single pending write against the index: an ``index`` operation carrying
+    a document, an ``update`` operation carrying some of the fields of a
+    document, or a ``delete`` operation.
+
+    If ``serialized`` is given, it is used as the action's NDJSON lines instead
+    of serializing the action again. ``hash`` is the content hash of the
+    document, if it has been computed.
+    """
+    __slots__ = ('op_type', 'doc_type', 'id', 'parent', 'doc', 'safe',
+                 'serialized', 'hash')
+
+    def __init__(self, op_type, doc_type, id, doc=None, parent=None,
+                 safe=False, serialized=None):
+        self.op_type = op_type
+        self.doc_type = doc_type
+        self.id = id
+        self.doc = doc
+        self.parent = parent
+        self.safe = safe
+        self.serialized = serialized
+        self.hash = None
+
+    def __repr__(self):
+        return '<%s %s %s:%s>' % (self.__class__.__name__, self.op_type,
+                                  self.doc_type, self.id)
+
+    @property
+    def key(self):
+        """
+        The identity of the document this action applies to. Later actions
+        with the same key supersede earlier ones.
+        """
+        return self.doc_type, self.id, self.parent
+
+    def metadata(self, index):
+        """
+        Return the action line for this operation, as a dict.
+        """
+        meta = {'_index': index, '_type': self.doc_type, '_id': self.id}
+        if self.parent:
+            if self.op_type == 'delete':
+                meta['_routing'] = self.parent
+            else:
+                meta['_parent'] = self.parent
+        return {self.op_type: meta}
+
+    def lines(self, index, dumps):
+        """
+        Return a list of serialized NDJSON lines for this operation.
+        """
+        if self.serialized is not None:
+            return self.serialized
+        lines = [dumps(self.metadata(index))]
+        if self.op_type == 'update':
+            lines.append(dumps({'doc': self.doc}))
+        elif self.op_type != 'delete':
+            lines.append(dumps(self.doc))
+        return lines
+
+    def merge(self, action):
+        """
+        Return a single action equivalent to this one followed by ``action``,
+        for the same document.
+        """
+        if action.op_type == 'delete' and self.op_type == 'index':
+            # The document may only have been created by the index action
+            # being replaced, in which case it was never sent, so the delete
+            # can miss.
+            return BulkAction('delete', action.doc_type, action.id,
+                              parent=action.parent, safe=True)
+        if action.op_type != 'update' or self.op_type == 'delete':
+            return action
+        doc = dict(self.doc)
+        doc.update(action.doc)
+        return BulkAction(self.op_type, self.doc_type, self.id, doc=doc,
+                          parent=self.parent,
+                          safe=self.safe and action.safe)
+
+    def failure(self, item):
+        """
+        Given the response item for this action from a bulk request, return
+        an error dict if it failed, or None if it succeeded.
+        """
+        result = item.get(self.op_type, {})
+        status = result.get('status', 200)
+        if status < 300:
+            return None
+        if status == 404 and self.safe:
+            if self.op_type == 'update':
+                log.warning('Not updating missing document %s:%s',
+                            self.doc_type, self.id)
+            return None
+        return dict(op_type=self.op_type,
+                    doc_type=self.doc_type,
+                    id=self.id,
+                    status=status,
+                    error=result.get('error'))
+
+
+class ActionQueue(object):
+    """
+    An ordered collection of pending actions, holding at most one action per
+    document: adding an action replaces any earlier one with the same key, or
+    in the case of an update, is merged into it.
+
+    Savepoints are supported with an undo journal. Taking a savepoint with
+    :py:meth:`mark` is constant-time, and rolling back to it with
+    :py:meth:`rollback` costs time proportional to the number of actions added
+    since, regardless of the size of the queue. The journal is only kept once
+    the first savepoint has been taken.
+    """
+
+    def __init__(self):
+        self.actions = OrderedDict()
+        self.journal = None
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions.values())
+
+    def __contains__(self, key):
+        return key in self.actions
+
+    def __repr__(self):
+        return '<%s (%d actions)>' % (self.__class__.__name__,
+                                      len(self.actions))
+
+    def close(self):
+        """
+        Release any resources held by the queue.
+        """
+        pass
+
+    def add(self, action):
+        """
+        Add an action, superseding any pending action for the same document.
+        """
+        key = action.key
+        previous = self.actions.get(key)
+        if self.journal is not None:
+            self.journal.append((key, previous))
+        if previous is not None:
+            action = previous.merge(action)
+        self.actions[key] = action
+
+    def mark(self):
+        """
+        Return a marker for the current state of the queue, which can later
+        be passed to :py:meth:`rollback`.
+        """
+        if self.journal is None:
+            self.journal = []
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """
+        Restore the queue to the state it was in when ``mark`` was taken.
+        """
+        journal = self.journal
+        actions = self.actions
+        while len(journal) > mark:
+            key, previous = journal.pop()
+            if previous is None:
+                del actions[key]
+            else:
+                actions[key] = previous
+
+
+class SpooledActionQueue(ActionQueue):
+    """
+    An :py:class:`ActionQueue` which moves its contents to a temporary file
+    once the actions held in memory exceed ``threshold`` bytes when
+    serialized. The file holds NDJSON lines ready to be sent to the bulk API,
+    and is streamed back from disk when the queue is iterated over.
+
+    Actions are only coalesced with others still held in memory. Rolling back
+    to a savepoint taken before the most recent spill is not supported.
+    """
+
+    def __init__(self, index, serializer, threshold, dir=None):
+        ActionQueue.__init__(self)
+        self.index = index
+        self.serializer = serializer
+        self.threshold = threshold
+        self.dir = dir
+        # Approximate, since superseded actions are still counted.
+        self.size = 0
+        self.spool = None
+        self.spooled = 0
+        self.spills = 0
+        # Record numbers of spooled deletes which may miss: this isn't part of
+        # the bulk action line, so it has to be tracked separately.
+        self.safe_records = set()
+
+    def __len__(self):
+        return self.spooled + len(self.actions)
+
+    def __contains__(self, key):
+        # Keys of spooled actions aren't kept, so once the queue has spilled,
+        # any key may have an action pending.
+        return self.spooled > 0 or key in self.actions
+
+    def __iter__(self):
+        if self.spool is not None:
+            for action in self._replay():
+                yield action
+        for action in self.actions.values():
+            yield action
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    def add(self, action):
+        ActionQueue.add(self, action)
+        dumps = self.serializer.dumps
+        if action.op_type == 'delete':
+            self.size += len(dumps(action.metadata(self.index)))
+        else:
+            self.size += len(dumps(action.doc))
+        if self.size > self.threshold:
+            self.spill()
+
+    def mark(self):
+        return self.spills, ActionQueue.mark(self)
+
+    def rollback(self, mark):
+        spills, mark = mark
+        if spills != self.spills:
+            raise ValueError("Can't roll back to a savepoint taken before "
+                             "the queue was spooled to disk")
+        ActionQueue.rollback(self, mark)
+
+    def spill(self):
+        """
+        Write the actions held in memory out to the spool file.
+        """
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile(prefix='pyramid_es-',
+                                                suffix='.ndjson',
+                                                dir=self.dir)
+        log.debug('Spooling %d actions to disk', len(self.actions))
+        dumps = self.serializer.dumps
+        for action in self.actions.values():
+            if action.safe:
+                self.safe_records.add(self.spooled)
+            for line in action.lines(self.index, dumps):
+                self.spool.write(line.encode('utf-8') + b'\n')
+            self.spooled += 1
+        self.actions.clear()
+        if self.journal is not None:
+            self.journal = []
+        self.size = 0
+        self.spills += 1
+
+    def _replay(self):
+        loads = self.serializer.loads
+        spool = self.spool
+        spool.flush()
+        spool.seek(0)
+        for n in range(self.spooled):
+            line = spool.readline().decode('utf-8').rstrip('\n')
+            op_type, meta = next(iter(loads(line).items()))
+            lines = [line]
+            if op_type != 'delete':
+                lines.append(spool.readline().decode('utf-8').rstrip('\n'))
+            yield BulkAction(op_type, meta['_type'], meta['_id'],
+                             parent=meta.get('_parent', meta.get('_routing')),
+                             safe=n in self.safe_records,
+                             serialized=lines)
+
+
+def chunk_actions(actions, index, dumps, chunk_size=DEFAULT_CHUNK_SIZE,
+                  max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES):
+    """
+    Serialize ``actions`` and split them into chunks no larger than
+    ``chunk_size`` actions or ``max_chunk_bytes`` bytes of payload. Yields
+    ``(actions, body)`` tuples, where ``body`` is the NDJSON request body for
+    that chunk.
+    """
+    chunk = []
+    lines = []
+    size = 0
+    for action in actions:
+        action_lines = action.lines(index, dumps)
+        action_size = sum(len(line.encode('utf-8')) + 1
+                          for line in action_lines)
+        if chunk and (len(chunk) >= chunk_size or
+                      size + action_size > max_chunk_bytes):
+            yield chunk, '\n'.join(lines) + '\n'
+            chunk = []
+            lines = []
+            size = 0
+        chunk.append(action)
+        lines.extend(action_lines)
+        size += action_size
+    if chunk:
+        yield chunk, '\n'.join(lines) + '\n'
+
+
+def bulk_failures(actions, response):
+    """
+    Match the items of a bulk response up with the submitted actions, and
+    return a list of error dicts for the ones that failed.
+    """
+    errors = []
+    if not response.get('errors', True):
+        return errors
+    for action, item in zip(actions, response['items']):
+        error = action.failure(item)
+        if error:
+            errors.append(error)
+    return errors
@@ -1,8 +1,14 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import logging
+import os
+import threading
+import time
+import weakref
 
 from itertools import chain
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 from pprint import pformat
 from functools import wraps
 
@@ -10,13 +16,20 @@ import six
 
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import NotFoundError
+from sqlalchemy import inspect
 
 import transaction as zope_transaction
 from zope.interface import implementer
 from transaction.interfaces import ISavepointDataManager
 
+from .background import BackgroundIndexer
+from .connection import ElasticConnection
+from .hashcache import document_hash
+from .bulk import (ActionQueue, SpooledActionQueue, BulkAction, BulkError,
+                   chunk_actions, bulk_failures, DEFAULT_CHUNK_SIZE,
+                   DEFAULT_MAX_CHUNK_BYTES)
 from .query import ElasticQuery
-from .result import ElasticResultRecord
+from .result import ElasticResult, ElasticResultRecord
 
 log = logging.getLogger(__name__)
 
@@ -62,32 +75,37 @@ CREATE_INDEX_SETTINGS.update({
     },
 })
 
-STATUS_ACTIVE = 'active'
-STATUS_CHANGED = 'changed'
-
-
-_CLIENT_STATE = {}
-
 
 @implementer(ISavepointDataManager)
 class ElasticDataManager(object):
+    """
+    Holds the queue of writes made by a client within one transaction, and
+    sends them when that transaction commits.
+
+    Objects in ``flushed`` are indexed when the transaction is committed, once
+    their final state is known. Its values are ``(obj, fields)`` pairs, where
+    ``fields`` is None to index the whole document, or the set of fields to
+    update. See :py:func:`.session.register`.
+    """
     def __init__(self, client, transaction_manager):
         self.client = client
         self.transaction_manager = transaction_manager
-        t = transaction_manager.get()
-        t.join(self)
-        _CLIENT_STATE[id(client)] = STATUS_ACTIVE
+        self.uncommitted = client._action_queue()
+        self.flushed = OrderedDict()
 
-        self._reset()
+        self.transaction = transaction_manager.get()
+        self.transaction.join(self)
+        client._data_managers[self.transaction] = self
 
     def _reset(self):
         log.error('_reset(%s)', self)
-        self.client.uncommitted = []
+        self.uncommitted.close()
+        self.uncommitted = self.client._action_queue()
+        self.flushed = OrderedDict()
 
     def _finish(self):
         log.error('_finish(%s)', self)
-        client = self.client
-        del _CLIENT_STATE[id(client)]
+        self.client._data_managers.pop(self.transaction, None)
 
     def abort(self, transaction):
         log.error('abort(%s)', self)
@@ -100,7 +118,17 @@ class ElasticDataManager(object):
 
     def commit(self, transaction):
         log.error('commit(%s)', self)
-        pass
+        # Other data managers have flushed by now, so the flushed objects are
+        # in their final state. Skip any which no longer exist, for instance
+        # because their insert was rolled back.
+        for obj, fields in self.flushed.values():
+            if not inspect(obj).persistent:
+                continue
+            if fields is None:
+                self.client.index_object(obj)
+            else:
+                self.client.update_object(obj, fields, safe=True)
+        self.flushed.clear()
 
     def tpc_vote(self, transaction):
         log.error('tpc_vote(%s)', self)
@@ -109,14 +137,24 @@ class ElasticDataManager(object):
         pass
 
     def tpc_finish(self, transaction):
-        # Actually persist the uncommitted queue.
+        # Actually persist the uncommitted queue, batched into as few bulk
+        # requests as possible.
         log.error('tpc_finish(%s)', self)
-        log.warn("running: %r", self.client.uncommitted)
-        for cmd, args, kwargs in self.client.uncommitted:
-            kwargs['immediate'] = True
-            getattr(self.client, cmd)(*args, **kwargs)
-        self._reset()
-        self._finish()
+        client = self.client
+        try:
+            if not len(self.uncommitted):
+                # Nothing was written, as in most read-only requests.
+                return
+            if client.indexer:
+                # The queue now belongs to the indexer, so swap in a new one
+                # rather than closing it.
+                client.indexer.submit(self.uncommitted)
+                self.uncommitted = client._action_queue()
+            else:
+                client.bulk(self.uncommitted)
+        finally:
+            self._reset()
+            self._finish()
 
     def tpc_abort(self, transaction):
         log.error('tpc_abort()')
@@ -137,23 +175,51 @@ class ElasticSavepoint(object):
 
     def __init__(self, dm):
         self.dm = dm
-        self.saved = dm.client.uncommitted.copy()
+        self.mark = dm.uncommitted.mark()
 
     def rollback(self):
-        self.dm.client.uncommitted = self.saved.copy()
+        self.dm.uncommitted.rollback(self.mark)
 
 
 def join_transaction(client, transaction_manager):
-    client_id = id(client)
-    existing_state = _CLIENT_STATE.get(client_id, None)
-    if existing_state is None:
-        log.error('client %s not found, setting up new data manager',
-                  client_id)
-        ElasticDataManager(client, transaction_manager)
-    else:
-        log.error('client %s found, using existing data manager',
-                  client_id)
-        _CLIENT_STATE[client_id] = STATUS_CHANGED
+    """
+    Return the data manager for ``client`` in the current transaction of
+    ``transaction_manager``, joining the transaction if necessary.
+    """
+    dm = client._data_managers.get(transaction_manager.get())
+    if dm is None:
+        log.error('client %s not in transaction, setting up new data manager',
+                  id(client))
+        dm = ElasticDataManager(client, transaction_manager)
+    return dm
+
+
+def _index_document_action(id, doc_type, doc, parent=None):
+    return BulkAction('index', doc_type, id, doc=doc, parent=parent)
+
+
+def _update_document_action(id, doc_type, doc, parent=None, safe=False):
+    return BulkAction('update', doc_type, id, doc=doc, parent=parent,
+                      safe=safe)
+
+
+def _delete_document_action(id, doc_type, parent=None, safe=False):
+    return BulkAction('delete', doc_type, id, parent=parent, safe=safe)
+
+
+_BULK_ACTIONS = {
+    'index_document': _index_document_action,
+    'update_document': _update_document_action,
+    'delete_document': _delete_document_action,
+}
+
+
+def bulk_action(cmd, *args, **kwargs):
+    """
+    Convert a call to a transactional client method, given by name along with
+    its arguments, to the equivalent :py:class:`.bulk.BulkAction`.
+    """
+    return _BULK_ACTIONS[cmd](*args, **kwargs)
 
 
 def transactional(f):
@@ -166,26 +232,256 @@ def transactional(f):
             else:
                 log.error('enqueueing action: %s: %r, %r', f.__name__, args,
                           kwargs)
-                join_transaction(client, client.transaction_manager)
-                client.uncommitted.append((f.__name__, args, kwargs))
+                dm = join_transaction(client, client.transaction_manager)
+                action = bulk_action(f.__name__, *args, **kwargs)
+                if not client._unchanged(action, dm.uncommitted):
+                    dm.uncommitted.add(action)
                 return
         return f(client, *args, **kwargs)
     return transactional_inner
 
 
+def _mapped_classes(base_class):
+    """
+    Return the classes with an ES mapping among those registered with a
+    SQLAlchemy declarative base class.
+    """
+    registry = getattr(base_class, '_decl_class_registry', None)
+    if registry is None:
+        # SQLAlchemy >= 1.4
+        registry = base_class.registry._class_registry
+    return [cls for cls in list(registry.values())
+            if hasattr(cls, 'elastic_mapping')]
+
+
+def _mapping_subset(a, b):
+    """
+    Return True if everything in the mapping definition ``a`` is also present
+    in ``b``.
+    """
+    if isinstance(a, dict):
+        return (isinstance(b, dict) and
+                all(k in b and _mapping_subset(v, b[k])
+                    for k, v in a.items()))
+    if isinstance(a, (list, tuple)):
+        return (isinstance(b, (list, tuple)) and len(a) == len(b) and
+                all(_mapping_subset(x, y) for x, y in zip(a, b)))
+    # The server may return scalar settings in a different form, such as
+    # strings for booleans or numbers.
+    return a == b or six.text_type(a).lower() == six.text_type(b).lower()
+
+
+# Every client, so that they can be reset in forked child processes.
+_clients = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for client in list(_clients):
+        client._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 class ElasticClient(object):
     """
     A handle for interacting with the Elasticsearch backend.
+
+    If ``background`` is true, writes queued by a transaction are handed to a
+    :py:class:`.background.BackgroundIndexer` when it commits, rather than
+    being sent before the commit returns.
+
+    If ``spool_threshold`` is set, writes queued by a transaction are moved to
+    a temporary file in ``spool_dir`` once they take up more than that many
+    bytes, keeping memory use bounded for very large transactions.
+
+    If ``hash_cache`` is given, it should be a :py:class:`.hashcache.HashCache`
+    which is used to skip writing documents identical to the last version
+    written by this client.
+
+    If ``serializer`` is given, it is used instead of the default JSON
+    serializer to encode requests and decode responses, for instance a
+    :py:class:`.serializer.JSONSerializer`.
+
+    ``timeout`` is the default timeout for requests, in seconds. Any
+    ``transport_options`` are passed on to the ``Elasticsearch`` transport and
+    to each :py:class:`.connection.ElasticConnection`, for example
+    ``maxsize``, ``pool_block``, ``keep_alive``, ``compress``,
+    ``max_retries``, ``retry_on_timeout`` and the ``sniff_*`` options.
+
+    If ``warm_up_after_fork`` is true, :py:meth:`warm_up` is called in each
+    process forked from the one the client was created in, on Python versions
+    with :py:func:`os.register_at_fork`.
     """
 
-    def __init__(self, servers, index, timeout=1.0, disable_indexing=False,
+    def __init__(self, servers, index, timeout=10.0, disable_indexing=False,
                  use_transaction=True,
-                 transaction_manager=zope_transaction.manager):
+                 transaction_manager=zope_transaction.manager,
+                 bulk_chunk_size=DEFAULT_CHUNK_SIZE,
+                 bulk_max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+                 background=False, background_workers=1,
+                 background_max_pending=10, spool_threshold=None,
+                 spool_dir=None, hash_cache=None, serializer=None,
+                 transport_options=None, warm_up_after_fork=False):
         self.index = index
         self.disable_indexing = disable_indexing
         self.use_transaction = use_transaction
         self.transaction_manager = transaction_manager
-        self.es = Elasticsearch(servers)
+        self._data_managers = {}
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_max_chunk_bytes = bulk_max_chunk_bytes
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.hash_cache = hash_cache
+        self.warm_up_after_fork = warm_up_after_fork
+        es_kwargs = dict(transport_options or {})
+        es_kwargs.setdefault('connection_class', ElasticConnection)
+        if serializer is not None:
+            es_kwargs['serializer'] = serializer
+        self.servers = servers
+        self.timeout = timeout
+        self.es_kwargs = es_kwargs
+        self._es = None
+        self._es_pid = None
+        self._es_lock = threading.Lock()
+        _clients.add(self)
+        if background:
+            self.indexer = BackgroundIndexer(
+                self,
+                workers=background_workers,
+                max_pending=background_max_pending)
+        else:
+            self.indexer = None
+
+    @property
+    def es(self):
+        """
+        The ``Elasticsearch`` instance used to talk to the server. It is
+        created on first use in each process, so that processes forked after
+        the client was configured, like the workers of a preforking server,
+        don't share connections with their parent.
+        """
+        es = self._es
+        if es is None or self._es_pid != os.getpid():
+            with self._es_lock:
+                if self._es is None or self._es_pid != os.getpid():
+                    self._es = Elasticsearch(self.servers,
+                                             timeout=self.timeout,
+                                             **self.es_kwargs)
+                    self._es_pid = os.getpid()
+                es = self._es
+        return es
+
+    @es.setter
+    def es(self, es):
+        self._es = es
+        self._es_pid = os.getpid()
+
+    def warm_up(self):
+        """
+        Open a connection to each configured server ahead of the first real
+        request, creating the ``Elasticsearch`` instance if needed. Returns the
+        number of servers which responded; failures are logged.
+        """
+        ok = 0
+        for conn in self.es.transport.connection_pool.connections:
+            try:
+                conn.perform_request('HEAD', '/')
+                ok += 1
+            except Exception:
+                log.warning('Failed to warm up connection to %s', conn.host,
+                            exc_info=True)
+        return ok
+
+    def close(self):
+        """
+        Close any open connections. A new ``Elasticsearch`` instance is
+        created if the client is used again.
+        """
+        with self._es_lock:
+            es, self._es = self._es, None
+        if es is not None:
+            for conn in es.transport.connection_pool.connections:
+                pool = getattr(conn, 'pool', None)
+                if pool is not None:
+                    pool.close()
+
+    def _after_fork(self):
+        # State inherited from the parent process is unusable here: its
+        # connections are shared with the parent, and its transactions and
+        # worker threads don't exist in this process.
+        self._es = None
+        self._es_pid = None
+        self._es_lock = threading.Lock()
+        self._data_managers = {}
+        if self.indexer:
+            self.indexer._reset()
+        if self.hash_cache is not None:
+            self.hash_cache._reset()
+        if self.warm_up_after_fork:
+            self.warm_up()
+
+    @property
+    def uncommitted(self):
+        """
+        The :py:class:`.bulk.ActionQueue` of writes pending in the current
+        transaction. Each transaction has its own queue, so one client can be
+        shared between threads.
+        """
+        dm = self._data_managers.get(self.transaction_manager.get())
+        if dm is None:
+            return ActionQueue()
+        return dm.uncommitted
+
+    def _unchanged(self, action, pending=()):
+        """
+        Return True if ``action`` would index a document identical to the
+        last one written for the same key, so it can be skipped. Writes for
+        keys with other actions ``pending`` are never skipped.
+
+        Otherwise, the action is about to be sent, so the cached hash for its
+        key is forgotten until :py:meth:`_written` records the new one: while
+        the write is in flight, another write of the old document must not be
+        skipped.
+        """
+        cache = self.hash_cache
+        if cache is None:
+            return False
+        if action.op_type == 'index':
+            action.hash = document_hash(action.doc)
+            if (action.key not in pending and
+                    cache.check(action.key, action.hash)):
+                log.debug('Skipping unchanged document %r', action)
+                return True
+        cache.discard(action.key)
+        return False
+
+    def _written(self, action):
+        """
+        Update the hash cache after ``action`` has been successfully sent.
+        """
+        cache = self.hash_cache
+        if cache is None:
+            return
+        if action.op_type == 'index' and action.hash is not None:
+            cache.set(action.key, action.hash)
+        else:
+            cache.discard(action.key)
+
+    def _clear_hash_cache(self):
+        # Documents written before are gone from the server, so none of them
+        # can be skipped as unchanged any more.
+        if self.hash_cache is not None:
+            self.hash_cache.clear()
+
+    def _action_queue(self):
+        if self.spool_threshold:
+            return SpooledActionQueue(self.index,
+                                      self.es.transport.serializer,
+                                      self.spool_threshold,
+                                      dir=self.spool_dir)
+        return ActionQueue()
 
     def ensure_index(self, recreate=False):
         """
@@ -196,6 +492,7 @@ class ElasticClient(object):
         if recreate or not exists:
             if exists:
                 self.es.indices.delete(self.index)
+            self._clear_hash_cache()
             self.es.indices.create(self.index,
                                    body=dict(settings=CREATE_INDEX_SETTINGS))
 
@@ -204,6 +501,7 @@ class ElasticClient(object):
         Delete the index on the ES server.
         """
         self.es.indices.delete(self.index)
+        self._clear_hash_cache()
 
     def ensure_mapping(self, cls, recreate=False):
         """
@@ -211,15 +509,7 @@ class ElasticClient(object):
         exist.
         """
         doc_type = cls.__name__
-        doc_mapping = cls.elastic_mapping()
-
-        doc_mapping = dict(doc_mapping)
-        if cls.elastic_parent:
-            doc_mapping["_parent"] = {
-                "type": cls.elastic_parent
-            }
-
-        doc_mapping = {doc_type: doc_mapping}
+        doc_mapping = {doc_type: cls.elastic_mapping_dict()}
 
         log.debug('Putting mapping: \n%s', pformat(doc_mapping))
         if recreate:
@@ -228,6 +518,7 @@ class ElasticClient(object):
                                                doc_type=doc_type)
             except NotFoundError:
                 pass
+            self._clear_hash_cache()
         self.es.indices.put_mapping(index=self.index,
                                     doc_type=doc_type,
                                     body=doc_mapping)
@@ -240,15 +531,60 @@ class ElasticClient(object):
         doc_type = cls.__name__
         self.es.indices.delete_mapping(index=self.index,
                                        doc_type=doc_type)
+        self._clear_hash_cache()
 
     def ensure_all_mappings(self, base_class, recreate=False):
         """
         Initialize explicit mappings for all subclasses of the specified
         SQLAlcehmy declarative base class.
         """
-        for cls in base_class._decl_class_registry.values():
-            if hasattr(cls, 'elastic_mapping'):
-                self.ensure_mapping(cls, recreate=recreate)
+        for cls in _mapped_classes(base_class):
+            self.ensure_mapping(cls, recreate=recreate)
+
+    def sync_mappings(self, base_class, workers=4):
+        """
+        Bring the mappings on the server up to date with those of all
+        subclasses of the specified SQLAlchemy declarative base class, sending
+        only the ones which are missing or have changed.
+
+        The current mappings are fetched with a single request, and each
+        class's mapping is compared with them: it is considered unchanged if
+        everything in it is already present on the server, which may have
+        added defaults of its own. Changed mappings are put concurrently from
+        up to ``workers`` threads.
+
+        Returns a dict mapping the document type of each mapping that was put
+        to ``'created'`` or ``'updated'``.
+        """
+        try:
+            current = self.get_mappings()
+        except NotFoundError:
+            current = {}
+
+        changes = {}
+        changed = []
+        for cls in _mapped_classes(base_class):
+            doc_type = cls.__name__
+            existing = current.get(doc_type)
+            if existing is None:
+                changes[doc_type] = 'created'
+            elif not _mapping_subset(cls.elastic_mapping_dict(), existing):
+                changes[doc_type] = 'updated'
+            else:
+                continue
+            changed.append(cls)
+
+        if changed:
+            pool = ThreadPool(min(workers, len(changed)))
+            try:
+                pool.map(self.ensure_mapping, changed)
+            finally:
+                pool.close()
+                pool.join()
+
+        for doc_type, change in sorted(changes.items()):
+            log.info('Mapping %s for %s', change, doc_type)
+        return changes
 
     def get_mappings(self, cls=None):
         """
@@ -280,15 +616,42 @@ class ElasticClient(object):
                             parent=doc_parent,
                             **kw)
 
+    def update_object(self, obj, fields=None, safe=False, **kw):
+        """
+        Update only some of the fields of the indexed document for an object,
+        using the ES update API. ``fields`` is a collection of top-level
+        document field names, and defaults to those depending on attributes
+        of the object that have changed since it was last flushed (see
+        :py:meth:`.mixin.ElasticMixin.elastic_changed_fields`). Does nothing if
+        there are no such fields.
+
+        The document must already be indexed, unless ``safe`` is true, in
+        which case the update is skipped with a warning if it isn't.
+        """
+        if fields is None:
+            fields = obj.elastic_changed_fields()
+        fields = set(fields)
+        fields.discard('_id')
+        if not fields:
+            return
+
+        doc_type, doc_id, doc_parent = obj.elastic_identity()
+        doc = obj.elastic_partial_document(fields)
+
+        log.debug('Updating object fields:\n%s', pformat(doc))
+
+        self.update_document(id=doc_id,
+                             doc_type=doc_type,
+                             doc=doc,
+                             parent=doc_parent,
+                             safe=safe,
+                             **kw)
+
     def delete_object(self, obj, safe=False, **kw):
         """
         Delete the indexed document for an object.
         """
-        doc = obj.elastic_document()
-
-        doc_type = obj.__class__.__name__
-        doc_id = doc.pop("_id")
-        doc_parent = obj.elastic_parent
+        doc_type, doc_id, doc_parent = obj.elastic_identity()
 
         self.delete_document(id=doc_id,
                              doc_type=doc_type,
@@ -305,6 +668,10 @@ class ElasticClient(object):
         if self.disable_indexing:
             return
 
+        action = _index_document_action(id, doc_type, doc, parent=parent)
+        if self._unchanged(action):
+            return
+
         kwargs = dict(index=self.index,
                       body=doc,
                       doc_type=doc_type,
@@ -312,6 +679,34 @@ class ElasticClient(object):
         if parent:
             kwargs['parent'] = parent
         self.es.index(**kwargs)
+        self._written(action)
+
+    @transactional
+    def update_document(self, id, doc_type, doc, parent=None, safe=False):
+        """
+        Update some of the fields of an indexed document from a raw partial
+        document source (not an object). If ``safe`` is true, a missing
+        document is skipped with a warning.
+        """
+        if self.disable_indexing:
+            return
+
+        kwargs = dict(index=self.index,
+                      body={'doc': doc},
+                      doc_type=doc_type,
+                      id=id)
+        if parent:
+            kwargs['parent'] = parent
+        action = _update_document_action(id, doc_type, doc, parent=parent)
+        self._unchanged(action)
+        try:
+            self.es.update(**kwargs)
+        except NotFoundError:
+            if not safe:
+                raise
+            log.warning('Not updating missing document %s:%s', doc_type, id)
+        finally:
+            self._written(action)
 
     @transactional
     def delete_document(self, id, doc_type, parent=None, safe=False):
@@ -327,11 +722,43 @@ class ElasticClient(object):
                       id=id)
         if parent:
             kwargs['routing'] = parent
+        action = _delete_document_action(id, doc_type, parent)
+        self._unchanged(action)
         try:
             self.es.delete(**kwargs)
         except NotFoundError:
             if not safe:
                 raise
+        finally:
+            self._written(action)
+
+    def bulk(self, actions):
+        """
+        Execute a sequence of :py:class:`.bulk.BulkAction` instances with the
+        ES bulk API, split into requests by action count and payload size.
+
+        Every chunk is sent even if an earlier one had failures: afterwards, a
+        :py:class:`.bulk.BulkError` describing all failed actions is raised.
+        """
+        if self.disable_indexing:
+            return
+
+        dumps = self.es.transport.serializer.dumps
+        errors = []
+        for chunk, body in chunk_actions(actions, self.index, dumps,
+                                         self.bulk_chunk_size,
+                                         self.bulk_max_chunk_bytes):
+            log.debug('Sending bulk request with %d actions', len(chunk))
+            resp = self.es.bulk(body=body)
+            errors.extend(bulk_failures(chunk, resp))
+            if self.hash_cache is not None:
+                for action, item in zip(chunk, resp['items']):
+                    # Forget deleted or updated documents even if the
+                    # write failed.
+                    if action.op_type != 'index' or not action.failure(item):
+                        self._written(action)
+        if errors:
+            raise BulkError(errors)
 
     def index_objects(self, objects):
         """
@@ -340,6 +767,65 @@ class ElasticClient(object):
         for obj in objects:
             self.index_object(obj)
 
+    def reindex(self, cls, session, query=None, chunk_size=1000,
+                max_in_flight=2, progress=None):
+        """
+        Index every instance of ``cls`` in the database, or only those matched
+        by ``query`` if it is given. Returns the number of documents indexed.
+
+        Rows are streamed from the database and documents built ``chunk_size``
+        at a time with :py:meth:`.mixin.ElasticMixin.elastic_documents`. Each
+        chunk is sent with the bulk API by a worker thread while the next one
+        is built, with at most ``max_in_flight`` chunks waiting to be sent, so
+        memory use doesn't grow with the size of the table.
+
+        If ``progress`` is given, it is called after each chunk is built with
+        the number of documents built so far and the elapsed time in seconds.
+
+        Writes are sent immediately, regardless of ``use_transaction``. Any
+        bulk failures are raised as a single :py:class:`.bulk.BulkError` once
+        all chunks have been sent.
+        """
+        if query is None:
+            query = session.query(cls)
+
+        failures = []
+        indexer = BackgroundIndexer(
+            self, max_pending=max_in_flight,
+            on_error=lambda actions, e: failures.append(e))
+
+        count = 0
+        start = time.time()
+        try:
+            for batch in cls.elastic_documents(query, batch_size=chunk_size):
+                actions = []
+                for (doc_type, doc_id, doc_parent), doc in batch:
+                    doc.pop('_id', None)
+                    actions.append(BulkAction('index', doc_type, doc_id,
+                                              doc=doc, parent=doc_parent))
+                indexer.submit(actions)
+                count += len(actions)
+                elapsed = time.time() - start
+                if progress:
+                    progress(count, elapsed)
+                log.debug('Reindexing %s: %d documents, %.1f/s',
+                          cls.__name__, count, count / (elapsed or 1))
+        finally:
+            indexer.shutdown()
+
+        elapsed = time.time() - start
+        log.info('Reindexed %d %s documents in %.1fs (%.1f/s)',
+                 count, cls.__name__, elapsed, count / (elapsed or 1))
+
+        errors = []
+        for e in failures:
+            if not isinstance(e, BulkError):
+                raise e
+            errors.extend(e.errors)
+        if errors:
+            raise BulkError(errors)
+        return count
+
     def flush(self, force=True):
         self.es.indices.flush(force=force)
 
@@ -351,9 +837,9 @@ class ElasticClient(object):
         if isinstance(obj, tuple):
             doc_type, doc_id = obj
         else:
-            doc_type, doc_id = obj.__class__.__name__, obj.id
-            if obj.elastic_parent:
-                routing = obj.elastic_parent
+            doc_type, doc_id, parent = obj.elastic_identity()
+            if parent:
+                routing = parent
 
         kwargs = dict(index=self.index,
                       doc_type=doc_type,
@@ -378,23 +864,83 @@ class ElasticClient(object):
         return [c.__name__ for c in classes
                 if hasattr(c, "elastic_mapping")]
 
-    def search(self, body, classes=None, fields=None, **query_params):
+    def _doc_types(self, classes):
         """
-        Run ES search using default indexes.
+        Return a comma-separated string of the document types to search for
+        the given classes or document type names.
         """
         doc_types = classes and list(chain.from_iterable(
             [doc_type] if isinstance(doc_type, six.string_types) else
             self.subtype_names(doc_type)
             for doc_type in classes))
+        return ','.join(doc_types)
 
+    def search(self, body, classes=None, fields=None, **query_params):
+        """
+        Run ES search using default indexes.
+        """
         if fields:
             query_params['fields'] = fields
 
         return self.es.search(index=self.index,
-                              doc_type=','.join(doc_types),
+                              doc_type=self._doc_types(classes),
                               body=body,
                               **query_params)
 
+    def multi_execute(self, queries):
+        """
+        Execute several queries with a single multi-search request, and
+        return a list of their result sets, in the same order.
+
+        Each item of ``queries`` is either an
+        :py:class:`.query.ElasticQuery`, or a ``(query, kwargs)`` tuple where
+        ``kwargs`` are the ``start``, ``size`` and ``fields`` arguments to
+        pass to its :py:meth:`~.query.ElasticQuery.execute`. Use a size of 0
+        to only fetch the total count.
+
+        A query which fails doesn't affect the others: its result has the
+        error message in its ``error`` attribute, which is None otherwise.
+        """
+        lines = []
+        for item in queries:
+            query, kwargs = item if isinstance(item, tuple) else (item, {})
+            body = dict(query._compile())
+            body['from'], body['size'] = query._range(kwargs.get('start'),
+                                                      kwargs.get('size'))
+            if kwargs.get('fields'):
+                body['fields'] = kwargs['fields']
+            header = {'index': self.index}
+            doc_types = self._doc_types(query.classes)
+            if doc_types:
+                header['type'] = doc_types
+            lines.extend([header, body])
+
+        if not lines:
+            return []
+        res = self.es.msearch(body=lines)
+        results = []
+        for raw in res['responses']:
+            result = ElasticResult(raw)
+            result.error = raw.get('error')
+            results.append(result)
+        return results
+
+    def scroll(self, scroll_id, scroll='5m'):
+        """
+        Fetch the next page of results for a scrolled search.
+        """
+        return self.es.scroll(scroll_id=scroll_id, scroll=scroll)
+
+    def clear_scroll(self, scroll_id):
+        """
+        Release the search context of a scrolled search. Failures are logged,
+        since the context expires on its own.
+        """
+        try:
+            self.es.clear_scroll(scroll_id=scroll_id)
+        except Exception:
+            log.warning('Failed to clear scroll %s', scroll_id, exc_info=True)
+
     def query(self, *classes, **kw):
         """
         Return an ElasticQuery against the specified class.
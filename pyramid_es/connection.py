@@ -0,0 +1,102 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+A connection class for the Elasticsearch transport with extra options for
+tuning how connections are pooled and what is sent over them.
+"""
+import gzip
+import io
+import time
+
+import urllib3
+from urllib3.exceptions import ReadTimeoutError, SSLError as UrllibSSLError
+
+from elasticsearch.compat import urlencode
+from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import (ConnectionError, ConnectionTimeout,
+                                      SSLError)
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class ElasticConnection(Urllib3HttpConnection):
+    """
+    An ``Urllib3HttpConnection`` which can also:
+
+    - Compress request bodies with gzip, if ``compress`` is true. Responses
+      are always requested with gzip encoding, which is used if the server has
+      ``http.compression`` enabled.
+    - Close connections after each request, if ``keep_alive`` is false.
+    - Make threads wait for a free connection once ``maxsize`` connections to
+      the host are in use, if ``pool_block`` is true, rather than opening
+      extra connections which are discarded after a single request.
+    """
+
+    def __init__(self, host='localhost', port=9200, compress=False,
+                 keep_alive=True, pool_block=False, **kwargs):
+        Urllib3HttpConnection.__init__(self, host=host, port=port, **kwargs)
+        self.compress = compress
+        self.headers.update(urllib3.make_headers(accept_encoding=True))
+        if not keep_alive:
+            self.headers['connection'] = 'close'
+        self.pool.block = pool_block
+        self.compressed_headers = dict(self.headers)
+        self.compressed_headers['content-encoding'] = 'gzip'
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        if not (self.compress and body):
+            return Urllib3HttpConnection.perform_request(
+                self, method, url, params=params, body=body, timeout=timeout,
+                ignore=ignore)
+
+        # The same as the base class, except that the body is compressed
+        # before it is sent, while the uncompressed body is logged.
+        url = self.url_prefix + url
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+        full_url = self.host + url
+
+        start = time.time()
+        try:
+            kw = {}
+            if timeout:
+                kw['timeout'] = timeout
+            if not isinstance(url, str):
+                url = url.encode('utf-8')
+            if not isinstance(method, str):
+                method = method.encode('utf-8')
+            response = self.pool.urlopen(method, url, gzip_compress(body),
+                                         retries=False,
+                                         headers=self.compressed_headers,
+                                         **kw)
+            duration = time.time() - start
+            raw_data = response.data.decode('utf-8')
+        except UrllibSSLError as e:
+            self.log_request_fail(method, full_url, body, time.time() - start,
+                                  exception=e)
+            raise SSLError('N/A', str(e), e)
+        except ReadTimeoutError as e:
+            self.log_request_fail(method, full_url, body, time.time() - start,
+                                  exception=e)
+            raise ConnectionTimeout('TIMEOUT', str(e), e)
+        except Exception as e:
+            self.log_request_fail(method, full_url, body, time.time() - start,
+                                  exception=e)
+            raise ConnectionError('N/A', str(e), e)
+
+        if (not (200 <= response.status < 300) and
+                response.status not in ignore):
+            self.log_request_fail(method, url, body, duration,
+                                  response.status)
+            self._raise_error(response.status, raw_data)
+
+        self.log_request_success(method, full_url, url, body, response.status,
+                                 raw_data, duration)
+
+        return response.status, response.getheaders(), raw_data
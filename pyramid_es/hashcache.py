@@ -0,0 +1,171 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+Caches of the content hash of the last document written for each document
+key, used to skip writes which wouldn't change anything.
+"""
+import json
+import hashlib
+import os
+import shelve
+import threading
+from collections import OrderedDict
+
+import six
+
+
+def document_hash(doc):
+    """
+    Return a stable hash of a document's content.
+    """
+    s = json.dumps(doc, sort_keys=True, separators=(',', ':'),
+                   default=six.text_type)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class HashCache(object):
+    """
+    Base class for a mapping of document keys to the hash of the document last
+    written for that key. Keeps count of how many writes have been checked
+    against the cache, and how many of those were skipped as unchanged.
+
+    Subclasses implement ``_get()``, ``_set()``, ``_discard()`` and
+    ``_clear()``.
+    """
+
+    def __init__(self):
+        self.checked = 0
+        self.skipped = 0
+        self._reset()
+
+    def _reset(self):
+        # Called in a child process after a fork, where the lock may have
+        # been held by a thread which doesn't exist any more.
+        self._lock = threading.Lock()
+
+    @property
+    def skip_ratio(self):
+        """
+        The fraction of checked writes which were skipped.
+        """
+        if not self.checked:
+            return 0.0
+        return self.skipped / self.checked
+
+    def check(self, key, hash):
+        """
+        Return True if ``hash`` matches the cached hash for ``key``, meaning
+        the write can be skipped.
+        """
+        with self._lock:
+            self.checked += 1
+            unchanged = self._get(key) == hash
+            if unchanged:
+                self.skipped += 1
+            return unchanged
+
+    def set(self, key, hash):
+        """
+        Record ``hash`` as the hash of the document last written for ``key``.
+        """
+        with self._lock:
+            self._set(key, hash)
+
+    def discard(self, key):
+        """
+        Forget the hash for ``key``, if there is one.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """
+        Forget every hash, for when the documents on the server are deleted.
+        """
+        with self._lock:
+            self._clear()
+
+
+class LRUHashCache(HashCache):
+    """
+    An in-process cache holding the hashes of up to ``maxsize`` documents,
+    discarding the least recently used ones first.
+    """
+
+    def __init__(self, maxsize=100000):
+        HashCache.__init__(self)
+        self.maxsize = maxsize
+        self.hashes = OrderedDict()
+
+    def _get(self, key):
+        hash = self.hashes.pop(key, None)
+        if hash is not None:
+            self.hashes[key] = hash
+        return hash
+
+    def _set(self, key, hash):
+        self.hashes.pop(key, None)
+        self.hashes[key] = hash
+        while len(self.hashes) > self.maxsize:
+            self.hashes.popitem(last=False)
+
+    def _discard(self, key):
+        self.hashes.pop(key, None)
+
+    def _clear(self):
+        self.hashes.clear()
+
+
+class ShelveHashCache(HashCache):
+    """
+    A cache stored on local disk at ``path``, using :py:mod:`shelve`, so that
+    it persists across restarts. The file is opened on first use in each
+    process, so that processes forked after the cache is created don't share
+    an open database handle.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._db_pid = None
+        HashCache.__init__(self)
+
+    def _reset(self):
+        HashCache._reset(self)
+        # Drop, rather than close, a database opened by the parent process.
+        self._db = None
+        self._db_pid = None
+
+    @property
+    def db(self):
+        pid = os.getpid()
+        if self._db is None or self._db_pid != pid:
+            self._db = shelve.open(self.path)
+            self._db_pid = pid
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+            self._db_pid = None
+
+    @staticmethod
+    def _db_key(key):
+        s = '\0'.join(six.text_type(part) for part in key)
+        if six.PY2:
+            s = s.encode('utf-8')
+        return s
+
+    def _get(self, key):
+        return self.db.get(self._db_key(key))
+
+    def _set(self, key, hash):
+        self.db[self._db_key(key)] = hash
+
+    def _discard(self, key):
+        self.db.pop(self._db_key(key), None)
+
+    def _clear(self):
+        self.db.clear()
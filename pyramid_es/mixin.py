@@ -5,6 +5,119 @@ Utility classes intended to make it easier to specify Elastic Search mappings
 for model objects.
 """
 import copy
+from operator import attrgetter
+
+import six
+from sqlalchemy import inspect
+
+try:
+    from sqlalchemy.orm import selectinload as eager_load
+except ImportError:  # SQLAlchemy < 1.2
+    from sqlalchemy.orm import subqueryload as eager_load
+
+
+def _class_cached(cls, name, factory):
+    """
+    Return the value cached under ``name`` on ``cls`` itself (not inherited
+    from a base class), calling ``factory()`` to create it the first time.
+    """
+    try:
+        return cls.__dict__[name]
+    except KeyError:
+        value = factory()
+        setattr(cls, name, value)
+        return value
+
+
+def _overrides_call(mapping):
+    return (six.get_unbound_function(type(mapping).__call__) is not
+            six.get_unbound_function(ESMapping.__call__))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _overrides_method(cls, name):
+    return (six.get_unbound_function(getattr(cls, name)) is not
+            six.get_unbound_function(getattr(ElasticMixin, name)))
+
+
+def _mapping_columns(cls):
+    mapper = inspect(cls)
+    if len(list(mapper.self_and_descendants)) > 1:
+        # Rows from a polymorphic query could need any subclass's mapping.
+        return None
+    if (_overrides_method(cls, 'elastic_document') or
+            _overrides_method(cls, 'elastic_identity')):
+        # Customized documents can only be built from instances.
+        return None
+    column_keys = set(prop.key for prop in mapper.column_attrs)
+
+    mapping = cls.elastic_cached_mapping()
+    if (mapping.attr or mapping.name or mapping.filter or
+            mapping.properties is None or _overrides_call(mapping)):
+        return None
+
+    keys = []
+    for prop in mapping.properties.values():
+        if (not isinstance(prop, ESMapping) or
+                prop.properties is not None or
+                _overrides_call(prop)):
+            return None
+        keys.append(prop.attr or prop.name)
+    if cls.__elastic_parent__:
+        keys.append(cls.__elastic_parent__[1])
+
+    if not column_keys.issuperset(keys):
+        return None
+    return [getattr(cls, key).label(key) for key in sorted(set(keys))]
+
+
+def _relationship_paths(cls, mapping):
+    """
+    Return the set of relationship paths of ``cls`` read by the properties of
+    ``mapping``, each a tuple of relationship names.
+    """
+    mapper = inspect(cls, raiseerr=False)
+    if mapper is None:
+        return set()
+    relationships = mapper.relationships
+    paths = set()
+    for prop in (mapping.properties or {}).values():
+        for name in getattr(prop, 'depends', None) or ():
+            if name.partition('.')[0] in relationships:
+                paths.add(tuple(name.split('.')))
+        key = getattr(prop, 'attr', None) or getattr(prop, 'name', None)
+        if key in relationships:
+            sub = set()
+            if isinstance(prop, ESMapping):
+                sub = _relationship_paths(relationships[key].mapper.class_,
+                                          prop)
+            paths.update((key,) + path for path in sub or [()])
+    return paths
+
+
+def _loader_option(cls, path):
+    option = None
+    for name in path:
+        rel = inspect(cls).relationships.get(name)
+        if rel is None:
+            break
+        attr = getattr(cls, name)
+        if option is None:
+            option = eager_load(attr)
+        else:
+            option = getattr(option, eager_load.__name__)(attr)
+        cls = rel.mapper.class_
+    return option
 
 
 class ElasticParent(object):
@@ -40,9 +153,185 @@ class ElasticMixin(object):
         """
         raise NotImplementedError("ES classes must define a mapping")
 
+    @classmethod
+    def elastic_cached_mapping(cls):
+        """
+        Return the result of ``elastic_mapping()``, which is built the first
+        time it is needed and cached on the class. The cached mapping is
+        shared, and must not be modified.
+        """
+        return _class_cached(cls, '_elastic_cached_mapping',
+                             cls.elastic_mapping)
+
+    @classmethod
+    def elastic_mapping_dict(cls):
+        """
+        Return the ES mapping definition for this class as plain dicts, ready
+        to be sent to ES. This is cached on the class, and must not be
+        modified.
+        """
+        def build():
+            d = dict(cls.elastic_cached_mapping())
+            if cls.elastic_parent:
+                d['_parent'] = {'type': cls.elastic_parent}
+            return d
+        return _class_cached(cls, '_elastic_mapping_dict', build)
+
+    @classmethod
+    def elastic_extractor(cls):
+        """
+        Return a function which builds the ES document for an instance of this
+        class. It is compiled from the mapping the first time it is needed,
+        and cached on the class.
+        """
+        return _class_cached(cls, '_elastic_extractor',
+                             lambda: cls.elastic_cached_mapping().compile())
+
+    @classmethod
+    def elastic_id_getter(cls):
+        """
+        Return a function which returns the ES document ID for an instance of
+        this class, taken from the ``_id`` field of the mapping. Cached on the
+        class.
+        """
+        def build():
+            props = cls.elastic_cached_mapping().properties or {}
+            if '_id' in props:
+                return props['_id'].compile()
+            return attrgetter('id')
+        return _class_cached(cls, '_elastic_id_getter', build)
+
+    def elastic_identity(self):
+        """
+        Return a ``(doc_type, id, parent)`` tuple identifying the ES document
+        for this instance, without building the document itself.
+        """
+        return (self.__class__.__name__,
+                self.elastic_id_getter()(self),
+                self.elastic_parent)
+
     def elastic_document(self):
         "Apply the class ES mapping to the current instance."
-        return self.elastic_mapping()(self)
+        return self.elastic_extractor()(self)
+
+    @classmethod
+    def elastic_field_extractors(cls):
+        """
+        Return a dict of functions which build each top-level field of the ES
+        document for an instance of this class. Cached on the class.
+        """
+        return _class_cached(
+            cls, '_elastic_field_extractors',
+            lambda: cls.elastic_cached_mapping().compile_fields())
+
+    def elastic_partial_document(self, fields):
+        """
+        Return a document containing only the given top-level ``fields`` of
+        the ES document for this instance.
+        """
+        extractors = self.elastic_field_extractors()
+        return dict((k, extractors[k](self)) for k in fields)
+
+    @classmethod
+    def elastic_dependencies(cls):
+        """
+        Return a dict mapping each top-level field of the ES document for this
+        class to the set of attribute names it is built from. Cached on the
+        class.
+        """
+        return _class_cached(
+            cls, '_elastic_dependencies',
+            lambda: cls.elastic_cached_mapping().dependencies())
+
+    def elastic_changed_fields(self):
+        """
+        Return the set of top-level document fields which depend on attributes
+        that have been modified and not yet flushed, according to SQLAlchemy's
+        attribute history.
+        """
+        attrs = inspect(self).attrs
+        deps = self.elastic_dependencies()
+        changed = set()
+        for name in set().union(*deps.values()):
+            key = name.partition('.')[0]
+            if key in attrs.keys() and attrs[key].history.has_changes():
+                changed.add(name)
+        return set(field for field, names in deps.items() if names & changed)
+
+    @classmethod
+    def elastic_columns(cls):
+        """
+        Return a list of the column attributes needed to build documents for
+        this class, labelled with their attribute names. Returns None if the
+        mapping needs anything besides plain column attributes, like a
+        relationship or a Python property, or if the class overrides
+        :py:meth:`elastic_document` or :py:meth:`elastic_identity`. Cached on
+        the class.
+        """
+        return _class_cached(cls, '_elastic_columns',
+                             lambda: _mapping_columns(cls))
+
+    @classmethod
+    def elastic_relationship_paths(cls):
+        """
+        Return the relationship paths read to build a document for this class,
+        as a sorted list of tuples of relationship names. They are found from
+        properties named after relationships, including nested mappings of
+        related objects, and from the ``depends`` of each property, which may
+        give dotted paths like ``'genre.studio'``. Cached on the class.
+        """
+        def paths():
+            found = _relationship_paths(cls, cls.elastic_cached_mapping())
+            # Loading a path loads every relationship along it, too.
+            return sorted(path for path in found
+                          if not any(other[:len(path)] == path and
+                                     other != path for other in found))
+        return _class_cached(cls, '_elastic_relationship_paths', paths)
+
+    @classmethod
+    def elastic_loader_options(cls):
+        """
+        Return a list of SQLAlchemy loader options which eagerly load the
+        relationships given by :py:meth:`elastic_relationship_paths`, so that
+        building documents for a batch of instances takes a fixed number of
+        queries instead of one per instance for each relationship.
+        """
+        return [_loader_option(cls, path)
+                for path in cls.elastic_relationship_paths()]
+
+    @classmethod
+    def elastic_documents(cls, query, batch_size=1000):
+        """
+        Build the ES documents for every instance of this class matched by
+        ``query``, a SQLAlchemy ``Query`` against the class. Yields lists of up
+        to ``batch_size`` ``(identity, doc)`` pairs, where ``identity`` is as
+        returned by :py:meth:`elastic_identity` and ``doc`` as returned by
+        :py:meth:`elastic_document`.
+
+        If :py:meth:`elastic_columns` is not None, only those columns are
+        selected, and documents are built straight from the result rows
+        without loading ORM instances. Otherwise, instances are loaded with
+        the relationships the mapping reads, as given by
+        :py:meth:`elastic_loader_options`, eagerly loaded for each batch.
+        """
+        columns = cls.elastic_columns()
+        if columns is None:
+            query = query.options(*cls.elastic_loader_options())
+            for objs in _batches(query.yield_per(batch_size), batch_size):
+                yield [(obj.elastic_identity(), obj.elastic_document())
+                       for obj in objs]
+            return
+
+        doc_type = cls.__name__
+        extract = cls.elastic_extractor()
+        get_id = cls.elastic_id_getter()
+        get_parent = (cls.__elastic_parent__ and
+                      attrgetter(cls.__elastic_parent__[1]))
+        rows = query.with_entities(*columns).yield_per(batch_size)
+        for batch in _batches(rows, batch_size):
+            yield [((doc_type, get_id(row), get_parent and get_parent(row)),
+                    extract(row))
+                   for row in batch]
 
     elastic_parent = ElasticParent()
 
@@ -55,12 +344,18 @@ class ESMapping(object):
     definition appropriate for pyes.
 
     Applying an ESMapping to another object returns an Elastic Search document.
+
+    ``depends`` can list the names of any other attributes that the value of
+    this mapping is computed from, like the relationships used by a Python
+    property. It is used to work out which fields of a document need updating
+    when an object changes.
     """
 
     def __init__(self, *args, **kwargs):
         self.filter = kwargs.pop("filter", None)
         self.name = kwargs.pop("name", None)
         self.attr = kwargs.pop("attr", None)
+        self.depends = kwargs.pop("depends", None)
 
         # Automatically map the id field
         self.parts = {"_id": ESField("_id", attr="id")}
@@ -139,13 +434,69 @@ class ESMapping(object):
             return instance
         return dict((k, v(instance)) for k, v in self.properties.items())
 
+    def compile(self):
+        """
+        Return a function which applies this mapping to an instance, like
+        calling the mapping does, but without walking the mapping tree for
+        every instance.
+
+        Mappings which override ``__call__`` are used as-is.
+        """
+        if _overrides_call(self):
+            return self
+
+        key = self.attr or self.name
+        get = attrgetter(key) if key else None
+        filter = self.filter
+        props = self.properties
+
+        if props is None:
+            if get and filter:
+                return lambda instance: filter(get(instance))
+            return get or filter or (lambda instance: instance)
+
+        fields = tuple(self.compile_fields().items())
+
+        def extract(instance):
+            return {k: f(instance) for k, f in fields}
+
+        if get and filter:
+            return lambda instance: extract(filter(get(instance)))
+        elif get or filter:
+            first = get or filter
+            return lambda instance: extract(first(instance))
+        return extract
+
+    def compile_fields(self):
+        """
+        Return a dict of compiled functions, like those returned by
+        :py:meth:`compile`, for each of the properties of this mapping.
+        """
+        return dict((k, v.compile() if isinstance(v, ESMapping) else v)
+                    for k, v in (self.properties or {}).items())
+
+    def dependencies(self):
+        """
+        Return a dict mapping the name of each of the properties of this
+        mapping to the set of attribute names its value is built from.
+        """
+        deps = {}
+        for k, v in (self.properties or {}).items():
+            names = set(getattr(v, 'depends', None) or ())
+            key = getattr(v, 'attr', None) or getattr(v, 'name', None)
+            if key:
+                names.add(key)
+            deps[k] = names
+        return deps
+
 
 class ESProp(ESMapping):
     "A leaf property."
-    def __init__(self, name, filter=None, attr=None, **kwargs):
+    def __init__(self, name, filter=None, attr=None, depends=None, **kwargs):
         self.name = name
         self.attr = attr
         self.filter = filter
+        self.depends = depends
         self.parts = kwargs
 
 
@@ -2,18 +2,24 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import logging
 
+import base64
 import copy
+import json
 from functools import wraps
 from collections import OrderedDict
 
 import six
 
-from .result import ElasticResult
+from .hashcache import document_hash
+from .result import ElasticResult, ElasticResultRecord, LazyElasticResult
 
 log = logging.getLogger(__name__)
 
 ARBITRARILY_LARGE_SIZE = 100000
 
+# Sizes of the requests made by lazy results, the last of which is repeated.
+LAZY_CHUNKS = (20, 100, 500)
+
 
 def generative(f):
     """
@@ -42,6 +48,48 @@ def filters(f):
     return wrapped
 
 
+def encode_cursor(values):
+    """
+    Encode the sort values of a hit as an opaque cursor string.
+    """
+    s = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(s).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor string to the list of sort values it was made from.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor: %r' % cursor)
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor: %r' % cursor)
+    return values
+
+
+def resume_filter(sorts, values):
+    """
+    Return a filter dict matching documents which sort after a document with
+    the given sort values, where ``sorts`` is a list of ``(field, order)``
+    pairs. Returns None if ``values`` is empty.
+    """
+    if not values:
+        return None
+    if len(values) != len(sorts):
+        raise ValueError('Cursor does not match the sorts of this query.')
+    clauses = []
+    for n, (field, order) in enumerate(sorts):
+        op = 'lt' if order == 'desc' else 'gt'
+        terms = [{'term': {f: v}}
+                 for (f, o), v in zip(sorts[:n], values[:n])]
+        terms.append({'range': {field: {op: values[n]}}})
+        clauses.append(terms[0] if len(terms) == 1 else {'and': terms})
+    return {'or': clauses}
+
+
 class ElasticQuery(object):
     """
     Represents a query to be issued against the ES backend.
@@ -64,6 +112,8 @@ class ElasticQuery(object):
 
         self._size = None
         self._start = None
+        self._after = None
+        self._body = None
 
     def _generate(self):
         s = self.__class__.__new__(self.__class__)
@@ -72,6 +122,7 @@ class ElasticQuery(object):
         s.suggests = s.suggests.copy()
         s.sorts = s.sorts.copy()
         s.facets = s.facets.copy()
+        s._body = None
         return s
 
     @staticmethod
@@ -236,11 +287,95 @@ class ElasticQuery(object):
         self._size = n
     size = limit
 
-    def _search(self, start=None, size=None, fields=None):
+    def _cursor_sorts(self):
+        """
+        Return the sorts of this query as a list of ``(field, order)`` pairs,
+        with a final sort on ``_uid`` to break ties.
+        """
+        sorts = []
+        for sort in self.sorts.values():
+            field, spec = next(iter(sort.items()))
+            if field == '_score':
+                raise ValueError("Can't paginate by cursor when sorting by "
+                                 "score.")
+            if isinstance(spec, dict):
+                spec = spec.get('order', 'asc')
+            sorts.append((field, spec))
+        if '_uid' not in [field for field, order in sorts]:
+            sorts.append(('_uid', 'asc'))
+        return sorts
+
+    @generative
+    def after(self, cursor):
+        """
+        Return results following the hit that ``cursor`` was taken from, as
+        returned with the ``cursor`` attribute of a result of :py:meth:`page`.
+        If ``cursor`` is None, return results from the start, sorted so that
+        they can be paginated by cursor.
+
+        Unlike an offset, this costs the same however deep the page is: it is
+        implemented as a filter on the values of this query's sorts, plus the
+        document's ``_uid`` to break ties. The query must have the same sorts
+        as the one the cursor was taken from, and can't be sorted by score.
+        """
+        self._after = decode_cursor(cursor) if cursor else []
+        # Check that the cursor matches the sorts now, rather than when the
+        # query is executed.
+        resume_filter(self._cursor_sorts(), self._after)
+
+    def page(self, size, cursor=None, fields=None):
+        """
+        Execute this query and return a result set of up to ``size`` results
+        following ``cursor``, or the first ``size`` results if it is None.
+
+        The result has a ``cursor`` attribute, which can be passed back to
+        fetch the following page, or None if there are no more results.
+        """
+        # One extra hit is fetched to tell whether there is another page.
+        result = self.after(cursor).execute(size=size + 1 if size else size,
+                                            fields=fields)
+        hits = result.raw['hits']['hits']
+        if size and len(hits) > size:
+            del hits[size:]
+            result.cursor = encode_cursor(hits[-1]['sort'])
+        return result
+
+    def _compile(self):
+        """
+        Return the request body for this query, without any start or size.
+
+        Since queries are never modified once generated, the body is built
+        once per query instance and cached. It must not be modified: copy it
+        to make any changes.
+        """
+        if self._body is None:
+            self._body = self._build_body()
+        return self._body
+
+    @property
+    def body_hash(self):
+        """
+        A stable hash of the request body for this query, which can be used
+        as a cache key. It doesn't cover the classes searched, or any start
+        and size passed when executing the query.
+        """
+        return document_hash(self._compile())
+
+    def _build_body(self):
         q = copy.copy(self.base_query)
 
-        if self.filters:
-            f = {'and': self.filters}
+        filters = self.filters
+        sorts = list(self.sorts.values())
+        if self._after is not None:
+            cursor_sorts = self._cursor_sorts()
+            sorts = [{field: {'order': order}}
+                     for field, order in cursor_sorts]
+            if self._after:
+                filters = filters + [resume_filter(cursor_sorts,
+                                                   self._after)]
+
+        if filters:
+            f = {'and': filters}
             q = {
                 'filtered': {
                     'filter': f,
@@ -248,6 +383,21 @@ class ElasticQuery(object):
                 }
             }
 
+        body = {
+            'sort': sorts,
+            'query': q
+        }
+        if self.facets:
+            body['facets'] = self.facets
+        if self.suggests:
+            body['suggest'] = self.suggests
+        return body
+
+    def _range(self, start=None, size=None):
+        """
+        Return the ``(from, size)`` to request, given the start and size
+        passed to :py:meth:`execute` and any offset and limit on this query.
+        """
         q_start = self._start or 0
         q_size = self._size or ARBITRARILY_LARGE_SIZE
 
@@ -259,25 +409,82 @@ class ElasticQuery(object):
         if start is not None:
             q_start = q_start + start
 
-        body = {
-            'sort': list(self.sorts.values()),
-            'query': q
-        }
-        if self.facets:
-            body['facets'] = self.facets
-        if self.suggests:
-            body['suggest'] = self.suggests
+        return q_start, q_size
 
+    def _search(self, start=None, size=None, fields=None):
+        body = self._compile()
+        q_start, q_size = self._range(start, size)
         return self.client.search(body, classes=self.classes, fields=fields,
                                   size=q_size, from_=q_start)
 
-    def execute(self, start=None, size=None, fields=None):
+    def execute(self, start=None, size=None, fields=None, lazy=False):
         """
         Execute this query and return a result set.
+
+        If ``lazy`` is true, return a :py:class:`.result.LazyElasticResult`
+        instead, which fetches hits in chunks of increasing size as it is
+        iterated over, and stops making requests when iteration stops.
         """
+        if lazy:
+            q_start, q_size = self._range(start, size)
+
+            def fetch(offset, size):
+                return self.client.search(self._compile(),
+                                          classes=self.classes, fields=fields,
+                                          size=size, from_=q_start + offset)
+            return LazyElasticResult(fetch, size=q_size, chunks=LAZY_CHUNKS)
         return ElasticResult(self._search(start=start, size=size,
                                           fields=fields))
 
+    def scan(self, size=500, scroll='5m', fields=None):
+        """
+        Iterate over every document matched by this query, yielding
+        :py:class:`.result.ElasticResultRecord` instances. Hits are fetched
+        with the scroll API, ``size`` at a time, so that any number of them
+        can be walked with bounded memory. ``scroll`` is how long the server
+        should keep the search context alive between pages.
+
+        If the query has no sorts, a ``scan`` search is used, which is cheaper
+        but returns hits in no particular order and up to ``size`` per shard
+        on each page. Facets and suggestions are not computed. Any offset or
+        limit on the query is applied as hits are yielded.
+        """
+        body = dict(self._compile())
+        body.pop('facets', None)
+        body.pop('suggest', None)
+        params = dict(size=size, scroll=scroll)
+        if not self.sorts:
+            params['search_type'] = 'scan'
+
+        skip = self._start or 0
+        remaining = self._size
+        res = self.client.search(body, classes=self.classes, fields=fields,
+                                 **params)
+        scroll_id = res.get('_scroll_id')
+        try:
+            hits = res['hits']['hits']
+            while remaining is None or remaining > 0:
+                for hit in hits:
+                    if skip:
+                        skip -= 1
+                        continue
+                    yield ElasticResultRecord(hit)
+                    if remaining is not None:
+                        remaining -= 1
+                        if not remaining:
+                            return
+                if not scroll_id:
+                    return
+                res = self.client.scroll(scroll_id, scroll=scroll)
+                scroll_id = res.get('_scroll_id', scroll_id)
+                hits = res['hits']['hits']
+                if not hits:
+                    return
+        finally:
+            if scroll_id:
+                self.client.clear_scroll(scroll_id)
+    iter_all = scan
+
     def count(self):
         """
         Execute this query to determine the number of documents that would be
@@ -42,9 +42,16 @@ class ElasticResult(object):
 
     Iterate over this object to yield document records, which are instances of
     :py:class:`ElasticResultRecord`.
+
+    Results returned by :py:meth:`.query.ElasticQuery.page` have a ``cursor``
+    attribute, which can be used to fetch the next page. Results returned by
+    :py:meth:`.client.ElasticClient.multi_execute` have an ``error``
+    attribute, which is the error message if that query failed.
     """
     def __init__(self, raw):
         self.raw = raw
+        self.cursor = None
+        self.error = None
 
     def __iter__(self):
         return (ElasticResultRecord(record)
@@ -73,3 +80,61 @@ class ElasticResult(object):
     @property
     def suggests(self):
         return self.raw['suggest']
+
+
+class LazyElasticResult(ElasticResult):
+    """
+    An :py:class:`ElasticResult` which fetches hits as they are iterated over,
+    in requests of increasing size given by ``chunks``, the last of which is
+    repeated. No more requests are made once iteration stops, so callers that
+    only need the first few matching hits don't pay to fetch the rest.
+
+    ``fetch(start, size)`` should run the search for ``size`` hits from
+    ``start`` and return the raw response. At most ``size`` hits are fetched
+    in total, if it is given. Hits already fetched are kept, so iterating
+    again doesn't repeat requests.
+
+    The ``raw`` response, used for :py:attr:`total`, :py:attr:`facets` and
+    :py:attr:`suggests`, is that of the first request.
+    """
+    def __init__(self, fetch, size=None, chunks=(20, 100, 500)):
+        self.fetch = fetch
+        self.size = size
+        self.chunks = chunks
+        self.cursor = None
+        self.error = None
+        self.hits = []
+        self.requests = 0
+        self.done = False
+        self._raw = None
+
+    def __iter__(self):
+        n = 0
+        while True:
+            while n < len(self.hits):
+                yield ElasticResultRecord(self.hits[n])
+                n += 1
+            if self.done:
+                return
+            self._fetch_next()
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            self._fetch_next()
+        return self._raw
+
+    def _fetch_next(self):
+        fetched = len(self.hits)
+        size = self.chunks[min(self.requests, len(self.chunks) - 1)]
+        if self.size is not None:
+            size = min(size, self.size - fetched)
+        res = self.fetch(fetched, size)
+        self.requests += 1
+        if self._raw is None:
+            self._raw = res
+        hits = res['hits']['hits']
+        self.hits.extend(hits)
+        self.done = (len(hits) < size or
+                     len(self.hits) >= res['hits']['total'] or
+                     (self.size is not None and len(self.hits) >= self.size))
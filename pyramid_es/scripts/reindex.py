@@ -0,0 +1,249 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+Console script to rebuild the index for a mapped class, with the primary key
+space split into ranges which are indexed in parallel by a pool of processes.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.path import DottedNameResolver
+from sqlalchemy import engine_from_config, func, inspect, orm
+
+from .. import client_from_config
+
+log = logging.getLogger(__name__)
+
+
+def primary_key(cls):
+    """
+    Return the primary key column attribute of ``cls``, which must have a
+    single-column primary key.
+    """
+    mapper = inspect(cls)
+    if len(mapper.primary_key) != 1:
+        raise ValueError('%s must have a single-column primary key' %
+                         cls.__name__)
+    return mapper.get_property_by_column(mapper.primary_key[0]).class_attribute
+
+
+def partition_ranges(session, cls, partitions):
+    """
+    Split the primary key space of ``cls`` into at most ``partitions`` ranges
+    holding roughly equal numbers of rows. Returns a list of ``(lower,
+    upper)`` tuples, where ``lower`` is exclusive, ``upper`` is inclusive, and
+    None means unbounded.
+    """
+    pk = primary_key(cls)
+    total = session.query(func.count(pk)).scalar()
+    step = -(-total // partitions)
+    bounds = []
+    for n in range(1, partitions):
+        if n * step >= total:
+            break
+        bound = session.query(pk).order_by(pk).\
+            offset(n * step - 1).limit(1).scalar()
+        bounds.append(bound)
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def range_query(session, cls, lower, upper):
+    """
+    Return a query for the instances of ``cls`` with primary keys in the given
+    range, as returned by :py:func:`partition_ranges`.
+    """
+    pk = primary_key(cls)
+    q = session.query(cls)
+    if lower is not None:
+        q = q.filter(pk > lower)
+    if upper is not None:
+        q = q.filter(pk <= upper)
+    return q
+
+
+# Primary key types which aren't JSON types, with functions to encode them as
+# strings in checkpoints and decode them again.
+_BOUND_TYPES = [
+    ('datetime', datetime, datetime.isoformat,
+     lambda s: datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%f' if '.' in s
+                                 else '%Y-%m-%dT%H:%M:%S')),
+    ('date', date, date.isoformat,
+     lambda s: datetime.strptime(s, '%Y-%m-%d').date()),
+    ('decimal', Decimal, str, Decimal),
+    ('uuid', uuid.UUID, str, uuid.UUID),
+]
+
+
+def _encode_bound(value):
+    for name, type_, encode, decode in _BOUND_TYPES:
+        if (isinstance(value, type_) and
+                getattr(value, 'tzinfo', None) is None):
+            return {'__type__': name, 'value': encode(value)}
+    raise TypeError("Can't record primary key value %r of type %s in a "
+                    "checkpoint" % (value, type(value).__name__))
+
+
+def _decode_bound(obj):
+    for name, type_, encode, decode in _BOUND_TYPES:
+        if obj.get('__type__') == name:
+            return decode(obj['value'])
+    return obj
+
+
+def load_checkpoint(path, class_name):
+    """
+    Load the checkpoint for a previous run against the same class, or return
+    None if there isn't one.
+    """
+    if not (path and os.path.exists(path)):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f, object_hook=_decode_bound)
+    if checkpoint['class'] != class_name:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Atomically write a checkpoint file. Range bounds can be of any JSON type,
+    or dates, naive datetimes, ``Decimal`` or ``UUID`` instances.
+    """
+    # Serialize first, so that an unsupported bound doesn't leave a partial
+    # file behind.
+    s = json.dumps(checkpoint, default=_encode_bound)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(s)
+    os.rename(tmp, path)
+
+
+# State for each worker process, set up by _init_worker().
+_worker = {}
+
+
+def _init_worker(settings, class_name):
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    _worker['session_factory'] = orm.sessionmaker(bind=engine)
+    _worker['client'] = client_from_config(settings)
+    _worker['cls'] = DottedNameResolver().resolve(class_name)
+
+
+def _reindex_range(args):
+    n, lower, upper, chunk_size = args
+    cls = _worker['cls']
+    session = _worker['session_factory']()
+    try:
+        count = _worker['client'].reindex(
+            cls, session,
+            query=range_query(session, cls, lower, upper),
+            chunk_size=chunk_size)
+    finally:
+        session.close()
+    return n, count
+
+
+def reindex(settings, class_name, processes=None, partitions=None,
+            chunk_size=1000, checkpoint_path=None):
+    """
+    Reindex all instances of the class given by the dotted name
+    ``class_name``, using a pool of ``processes`` worker processes, each with
+    its own database and ES connections. The primary key space is split into
+    ``partitions`` ranges, which default to four per process.
+
+    If ``checkpoint_path`` is given, the ranges and which of them have been
+    completed are recorded there, so that an interrupted run can be resumed.
+    The checkpoint is removed once every range has been indexed.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    partitions = partitions or processes * 4
+
+    checkpoint = load_checkpoint(checkpoint_path, class_name)
+    if checkpoint is None:
+        cls = DottedNameResolver().resolve(class_name)
+        engine = engine_from_config(settings, 'sqlalchemy.')
+        session = orm.Session(bind=engine)
+        try:
+            ranges = partition_ranges(session, cls, partitions)
+        finally:
+            session.close()
+            engine.dispose()
+        checkpoint = {'class': class_name, 'ranges': ranges, 'done': []}
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, checkpoint)
+    else:
+        log.info('Resuming from checkpoint: %d of %d ranges done',
+                 len(checkpoint['done']), len(checkpoint['ranges']))
+
+    done = set(checkpoint['done'])
+    tasks = [(n, lower, upper, chunk_size)
+             for n, (lower, upper) in enumerate(checkpoint['ranges'])
+             if n not in done]
+
+    total = 0
+    start = time.time()
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (settings, class_name))
+    try:
+        for n, count in pool.imap_unordered(_reindex_range, tasks):
+            total += count
+            checkpoint['done'].append(n)
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, checkpoint)
+            log.info('Range %d done: %d documents (%d of %d ranges, '
+                     '%.1f docs/s)', n, count, len(checkpoint['done']),
+                     len(checkpoint['ranges']),
+                     total / ((time.time() - start) or 1))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if checkpoint_path:
+        os.remove(checkpoint_path)
+    return total
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description='Rebuild the Elasticsearch index for a mapped class, '
+                    'using several processes.')
+    parser.add_argument('config_uri',
+                        help='Pyramid config file, like development.ini')
+    parser.add_argument('class_name',
+                        help='Dotted name of the class to reindex, like '
+                             'myapp.models:Article')
+    parser.add_argument('-p', '--processes', type=int,
+                        help='Number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('-n', '--partitions', type=int,
+                        help='Number of primary key ranges to split the '
+                             'table into (default: 4 per process)')
+    parser.add_argument('-c', '--chunk-size', type=int, default=1000,
+                        help='Number of documents per bulk request')
+    parser.add_argument('--checkpoint',
+                        help='File to record progress in, to resume an '
+                             'interrupted run')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+
+    start = time.time()
+    total = reindex(settings, args.class_name,
+                    processes=args.processes,
+                    partitions=args.partitions,
+                    chunk_size=args.chunk_size,
+                    checkpoint_path=args.checkpoint)
+    print('Indexed %d documents in %.1fs' % (total, time.time() - start))
@@ -0,0 +1,86 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+JSON serializers which can be plugged into the Elasticsearch transport, in
+place of the default one, with the ``elastic.serializer`` setting.
+"""
+import json
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import six
+from elasticsearch.exceptions import SerializationError
+
+
+class JSONSerializer(object):
+    """
+    A serializer using the standard library :py:mod:`json` module, with a
+    single encoder reused for every request rather than one created per
+    request, and compact output.
+
+    Dates, times and datetimes are encoded in ISO 8601 format, ``UUID``
+    instances as strings, and ``Decimal`` instances as numbers, or null if
+    they are not finite.
+    """
+    mimetype = 'application/json'
+
+    def __init__(self):
+        self._encode = json.JSONEncoder(default=self.default,
+                                        ensure_ascii=False,
+                                        separators=(',', ':')).encode
+        self._decode = json.JSONDecoder().decode
+
+    def default(self, data):
+        if isinstance(data, (date, datetime, time)):
+            return data.isoformat()
+        elif isinstance(data, Decimal):
+            return float(data) if data.is_finite() else None
+        elif isinstance(data, uuid.UUID):
+            return six.text_type(data)
+        raise TypeError("Unable to serialize %r (type: %s)" %
+                        (data, type(data)))
+
+    def loads(self, s):
+        try:
+            return self._decode(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # Strings are assumed to be serialized already.
+        if isinstance(data, six.string_types):
+            return data
+        try:
+            return self._encode(data)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    A serializer using the optional ``orjson`` package, which is several
+    times faster than the standard library on large request bodies. Values
+    are encoded the same way as by :py:class:`JSONSerializer`.
+    """
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, s):
+        try:
+            return self._orjson.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if isinstance(data, six.string_types):
+            return data
+        try:
+            # orjson handles dates and UUIDs itself.
+            return self._orjson.dumps(
+                data, default=self.default,
+                option=self._orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
@@ -0,0 +1,76 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+"""
+Integration with SQLAlchemy sessions, to index objects automatically when
+they are flushed.
+"""
+from sqlalchemy import event
+
+from .client import join_transaction
+from .mixin import ElasticMixin
+
+
+def register(session, client, partial=False):
+    """
+    Keep the index up to date with :py:class:`.mixin.ElasticMixin` instances
+    flushed by ``session``, which can be anything that accepts SQLAlchemy
+    session events, like a ``Session``, ``sessionmaker`` or
+    ``scoped_session``.
+
+    New and modified objects are collected at each flush, and indexed once
+    each when the transaction commits, in the same bulk request as other
+    writes made in the transaction. Deleted objects are removed from the index.
+
+    If ``partial`` is true, only the fields of modified objects which changed
+    are updated. Updates of documents missing from the index are skipped with
+    a warning rather than failing the commit.
+
+    The session should be managed by the same transaction manager as the
+    client, for instance with ``zope.sqlalchemy`` and ``pyramid_tm``. If the
+    client doesn't use transactions, objects are indexed at each flush.
+    """
+    def join(*args):
+        # Join the transaction as soon as the session is used, since it
+        # can't be joined once the transaction has started to commit.
+        if client.use_transaction:
+            join_transaction(client, client.transaction_manager)
+
+    def after_flush(session, flush_context):
+        # Pairs of (obj, fields), where fields is None to index the whole
+        # document. Attribute history is still available at this point.
+        changed = [(obj, None) for obj in session.new
+                   if isinstance(obj, ElasticMixin)]
+        for obj in session.dirty:
+            if not isinstance(obj, ElasticMixin):
+                continue
+            if partial:
+                fields = obj.elastic_changed_fields()
+                if fields:
+                    changed.append((obj, fields))
+            else:
+                changed.append((obj, None))
+        deleted = [obj for obj in session.deleted
+                   if isinstance(obj, ElasticMixin)]
+
+        if client.use_transaction:
+            dm = join_transaction(client, client.transaction_manager)
+            for obj, fields in changed:
+                if id(obj) in dm.flushed:
+                    pending = dm.flushed[id(obj)][1]
+                    fields = pending and fields and (pending | fields)
+                dm.flushed[id(obj)] = obj, fields
+            for obj in deleted:
+                dm.flushed.pop(id(obj), None)
+        else:
+            for obj, fields in changed:
+                if fields is None:
+                    client.index_object(obj)
+                else:
+                    client.update_object(obj, fields, safe=True)
+
+        for obj in deleted:
+            client.delete_object(obj, safe=True)
+
+    event.listen(session, 'after_begin', join)
+    event.listen(session, 'after_attach', join)
+    event.listen(session, 'after_flush', after_flush)
@@ -58,7 +58,8 @@ class Movie(Base, ElasticMixin):
                 ESString('director'),
                 ESField('year'),
                 ESField('rating'),
-                ESString('genre_title', analyzer='lowercase')))
+                ESString('genre_title', analyzer='lowercase',
+                         depends=['genre', 'genre_id'])))
 
 
 class Unindexed(Base):
@@ -0,0 +1,84 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import gc
+import threading
+import weakref
+from unittest import TestCase
+
+from six.moves.queue import Full
+
+from ..background import BackgroundIndexer, _running
+
+
+class RecordingClient(object):
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.release = threading.Event()
+        self.release.set()
+
+    def bulk(self, actions):
+        self.release.wait()
+        if self.fail:
+            raise RuntimeError('bulk failed')
+        self.batches.append(actions)
+
+
+class TestBackgroundIndexer(TestCase):
+
+    def test_submit_and_join(self):
+        client = RecordingClient()
+        indexer = BackgroundIndexer(client, workers=2)
+        for n in range(5):
+            indexer.submit(list(range(n)))
+        indexer.join()
+        indexer.shutdown()
+        self.assertEqual(sorted(len(batch) for batch in client.batches),
+                         [0, 1, 2, 3, 4])
+
+    def test_shutdown_drains(self):
+        client = RecordingClient()
+        client.release.clear()
+        indexer = BackgroundIndexer(client)
+        indexer.submit([1])
+        indexer.submit([2])
+        client.release.set()
+        indexer.shutdown()
+        self.assertEqual(client.batches, [[1], [2]])
+        self.assertEqual(indexer.threads, [])
+
+    def test_backpressure(self):
+        client = RecordingClient()
+        client.release.clear()
+        indexer = BackgroundIndexer(client, max_pending=1)
+        indexer.submit([1])
+        indexer.submit([2])
+        # One batch is blocked in the worker, and one is waiting: the queue is
+        # full.
+        with self.assertRaises(Full):
+            indexer.submit([3], timeout=0.05)
+        client.release.set()
+        indexer.shutdown()
+
+    def test_on_error(self):
+        errors = []
+        client = RecordingClient(fail=True)
+        indexer = BackgroundIndexer(
+            client, on_error=lambda actions, e: errors.append((actions, e)))
+        indexer.submit([1, 2])
+        indexer.shutdown()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], [1, 2])
+        self.assertIsInstance(errors[0][1], RuntimeError)
+
+    def test_released_after_shutdown(self):
+        indexer = BackgroundIndexer(RecordingClient())
+        indexer.submit([1])
+        self.assertIn(indexer, _running)
+        indexer.shutdown()
+        self.assertNotIn(indexer, _running)
+        ref = weakref.ref(indexer)
+        del indexer
+        gc.collect()
+        self.assertIsNone(ref())
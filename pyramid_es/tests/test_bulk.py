@@ -0,0 +1,191 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+from unittest import TestCase
+
+from ..bulk import (ActionQueue, BulkAction, SpooledActionQueue,
+                    chunk_actions, bulk_failures)
+
+
+def make_actions(n):
+    return [BulkAction('index', 'Thing', i, doc={'name': 'thing %d' % i})
+            for i in range(n)]
+
+
+class TestBulk(TestCase):
+
+    def test_lines(self):
+        action = BulkAction('index', 'Movie', 'abc', doc={'title': 'Sleeper'},
+                            parent='xyz')
+        lines = action.lines('movies', json.dumps)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]),
+                         {'index': {'_index': 'movies',
+                                    '_type': 'Movie',
+                                    '_id': 'abc',
+                                    '_parent': 'xyz'}})
+        self.assertEqual(json.loads(lines[1]), {'title': 'Sleeper'})
+
+    def test_delete_lines(self):
+        action = BulkAction('delete', 'Movie', 'abc', parent='xyz')
+        lines = action.lines('movies', json.dumps)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0]),
+                         {'delete': {'_index': 'movies',
+                                     '_type': 'Movie',
+                                     '_id': 'abc',
+                                     '_routing': 'xyz'}})
+
+    def test_update_lines(self):
+        action = BulkAction('update', 'Movie', 'abc', doc={'year': 1959})
+        lines = action.lines('movies', json.dumps)
+        self.assertEqual(json.loads(lines[0]),
+                         {'update': {'_index': 'movies',
+                                     '_type': 'Movie',
+                                     '_id': 'abc'}})
+        self.assertEqual(json.loads(lines[1]), {'doc': {'year': 1959}})
+
+    def test_merge_updates(self):
+        queue = ActionQueue()
+        queue.add(BulkAction('update', 'Movie', 'abc', doc={'year': 1958}))
+        queue.add(BulkAction('update', 'Movie', 'abc', doc={'rating': 8}))
+        queue.add(BulkAction('update', 'Movie', 'abc', doc={'year': 1959}))
+        [action] = list(queue)
+        self.assertEqual(action.op_type, 'update')
+        self.assertEqual(action.doc, {'year': 1959, 'rating': 8})
+
+    def test_merge_update_into_index(self):
+        queue = ActionQueue()
+        queue.add(BulkAction('index', 'Movie', 'abc',
+                             doc={'title': 'Vertigo', 'year': 1958}))
+        mark = queue.mark()
+        queue.add(BulkAction('update', 'Movie', 'abc', doc={'year': 1959}))
+        [action] = list(queue)
+        self.assertEqual(action.op_type, 'index')
+        self.assertEqual(action.doc, {'title': 'Vertigo', 'year': 1959})
+
+        queue.rollback(mark)
+        [action] = list(queue)
+        self.assertEqual(action.doc, {'title': 'Vertigo', 'year': 1958})
+
+    def test_update_after_delete(self):
+        queue = ActionQueue()
+        queue.add(BulkAction('delete', 'Movie', 'abc'))
+        queue.add(BulkAction('update', 'Movie', 'abc', doc={'year': 1959}))
+        [action] = list(queue)
+        self.assertEqual(action.op_type, 'update')
+
+    def test_chunk_by_count(self):
+        chunks = list(chunk_actions(make_actions(7), 'things', json.dumps,
+                                    chunk_size=3))
+        self.assertEqual([len(actions) for actions, body in chunks],
+                         [3, 3, 1])
+        actions, body = chunks[0]
+        self.assertTrue(body.endswith('\n'))
+        self.assertEqual(len(body.splitlines()), 6)
+
+    def test_chunk_by_bytes(self):
+        actions = make_actions(4)
+        size = sum(len(line) + 1
+                   for line in actions[0].lines('things', json.dumps))
+        chunks = list(chunk_actions(actions, 'things', json.dumps,
+                                    max_chunk_bytes=size * 2))
+        self.assertEqual([len(actions) for actions, body in chunks], [2, 2])
+
+    def test_chunk_oversized_action(self):
+        # An action larger than the byte limit still gets sent, on its own.
+        chunks = list(chunk_actions(make_actions(2), 'things', json.dumps,
+                                    max_chunk_bytes=1))
+        self.assertEqual([len(actions) for actions, body in chunks], [1, 1])
+
+    def test_failures(self):
+        actions = [BulkAction('index', 'Thing', 1, doc={}),
+                   BulkAction('delete', 'Thing', 2),
+                   BulkAction('delete', 'Thing', 3, safe=True)]
+        response = {
+            'errors': True,
+            'items': [
+                {'index': {'_id': 1, 'status': 400,
+                           'error': 'MapperParsingException'}},
+                {'delete': {'_id': 2, 'status': 404, 'found': False}},
+                {'delete': {'_id': 3, 'status': 404, 'found': False}},
+            ]
+        }
+        errors = bulk_failures(actions, response)
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(errors[0]['op_type'], 'index')
+        self.assertEqual(errors[0]['error'], 'MapperParsingException')
+        self.assertEqual(errors[1]['op_type'], 'delete')
+        self.assertEqual(errors[1]['status'], 404)
+
+    def test_safe_update_of_missing_document(self):
+        actions = [BulkAction('update', 'Thing', 1, doc={}, safe=True),
+                   BulkAction('update', 'Thing', 2, doc={})]
+        response = {
+            'errors': True,
+            'items': [
+                {'update': {'_id': 1, 'status': 404,
+                            'error': 'DocumentMissingException'}},
+                {'update': {'_id': 2, 'status': 404,
+                            'error': 'DocumentMissingException'}},
+            ]
+        }
+        errors = bulk_failures(actions, response)
+        self.assertEqual([error['id'] for error in errors], [2])
+
+    def test_no_failures(self):
+        actions = make_actions(2)
+        response = {
+            'errors': False,
+            'items': [{'index': {'_id': 0, 'status': 201}},
+                      {'index': {'_id': 1, 'status': 200}}],
+        }
+        self.assertEqual(bulk_failures(actions, response), [])
+
+
+class TestSpooledActionQueue(TestCase):
+
+    def make_queue(self, threshold=100):
+        return SpooledActionQueue('things', json, threshold)
+
+    def test_spill_and_replay(self):
+        queue = self.make_queue()
+        for action in make_actions(20):
+            queue.add(action)
+        queue.add(BulkAction('delete', 'Thing', 3, parent='p', safe=True))
+        self.assertGreater(queue.spills, 0)
+        self.assertLess(len(queue.actions), 20)
+        self.assertEqual(len(queue), 21)
+
+        actions = list(queue)
+        self.assertEqual([action.id for action in actions],
+                         list(range(20)) + [3])
+        self.assertEqual(actions[5].lines('things', json.dumps),
+                         make_actions(6)[5].lines('things', json.dumps))
+        self.assertEqual(actions[-1].op_type, 'delete')
+        self.assertEqual(actions[-1].parent, 'p')
+        queue.close()
+
+    def test_replayed_safe_flag(self):
+        queue = self.make_queue(threshold=1)
+        queue.add(BulkAction('delete', 'Thing', 1))
+        queue.add(BulkAction('delete', 'Thing', 2, safe=True))
+        self.assertEqual(len(queue.actions), 0)
+        self.assertEqual([action.safe for action in queue], [False, True])
+
+    def test_rollback_in_memory(self):
+        queue = self.make_queue(threshold=1000)
+        queue.add(make_actions(1)[0])
+        mark = queue.mark()
+        for action in make_actions(3):
+            queue.add(action)
+        queue.rollback(mark)
+        self.assertEqual(len(queue), 1)
+
+    def test_rollback_past_spill(self):
+        queue = self.make_queue(threshold=100)
+        mark = queue.mark()
+        for action in make_actions(20):
+            queue.add(action)
+        with self.assertRaises(ValueError):
+            queue.rollback(mark)
@@ -0,0 +1,165 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import gzip
+import io
+import os
+import threading
+from unittest import TestCase, skipUnless
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from .. import client_from_config
+from ..background import _STOP
+from ..client import ElasticClient
+from ..connection import ElasticConnection
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.server.requests.append((dict(self.headers.items()), b''))
+        self.send_response(200)
+        self.send_header('content-length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers['content-length'])
+        self.server.requests.append((dict(self.headers.items()),
+                                     self.rfile.read(length)))
+        body = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnection(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def request(self, **kwargs):
+        conn = ElasticConnection(port=self.server.server_port, **kwargs)
+        status, headers, data = conn.perform_request(
+            'POST', '/_bulk', body='{"a":1}\n'.encode('utf-8'))
+        self.assertEqual(status, 200)
+        self.assertEqual(data, '{"ok":true}')
+        return self.server.requests[-1]
+
+    def test_uncompressed(self):
+        headers, body = self.request()
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(headers['connection'], 'keep-alive')
+        self.assertEqual(body, b'{"a":1}\n')
+
+    def test_compressed(self):
+        headers, body = self.request(compress=True, keep_alive=False)
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['connection'], 'close')
+        with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+            self.assertEqual(f.read(), b'{"a":1}\n')
+
+    def test_warm_up(self):
+        client = ElasticClient(
+            servers=['127.0.0.1:%d' % self.server.server_port],
+            index='pyramid_es_tests')
+        self.assertEqual(client.warm_up(), 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_pool_block(self):
+        conn = ElasticConnection(maxsize=3, pool_block=True)
+        self.assertTrue(conn.pool.block)
+        self.assertEqual(conn.pool.pool.maxsize, 3)
+
+
+class TestTransportSettings(TestCase):
+
+    def test_settings(self):
+        client = client_from_config({
+            'elastic.index': 'pyramid_es_tests',
+            'elastic.servers': 'localhost:9200 localhost:9201',
+            'elastic.timeout': '2.5',
+            'elastic.maxsize': '25',
+            'elastic.pool_block': 'true',
+            'elastic.compress': 'true',
+            'elastic.max_retries': '5',
+            'elastic.retry_on_timeout': 'true',
+        })
+        transport = client.es.transport
+        self.assertEqual(transport.max_retries, 5)
+        self.assertTrue(transport.retry_on_timeout)
+        self.assertEqual(len(transport.connection_pool.connections), 2)
+        for conn in transport.connection_pool.connections:
+            self.assertIsInstance(conn, ElasticConnection)
+            self.assertEqual(conn.timeout, 2.5)
+            self.assertTrue(conn.compress)
+            self.assertTrue(conn.pool.block)
+            self.assertEqual(conn.pool.pool.maxsize, 25)
+
+
+class TestLazyClient(TestCase):
+
+    def make_client(self, **kwargs):
+        return ElasticClient(servers=['localhost:9200'],
+                             index='pyramid_es_tests', **kwargs)
+
+    def test_created_on_first_use(self):
+        client = self.make_client()
+        self.assertIsNone(client._es)
+        es = client.es
+        self.assertIs(client.es, es)
+
+    def test_recreated_in_other_process(self):
+        client = self.make_client()
+        es = client.es
+        client._es_pid = -1
+        self.assertIsNot(client.es, es)
+
+    def test_indexer_restarted_in_other_process(self):
+        client = self.make_client(background=True)
+        indexer = client.indexer
+        sent = []
+        client.bulk = sent.extend
+        indexer.submit([1])
+        indexer.join()
+        queue = indexer.queue
+        indexer._pid = -1
+        indexer.submit([2])
+        indexer.join()
+        self.assertIsNot(indexer.queue, queue)
+        self.assertEqual(sent, [1, 2])
+        indexer.shutdown()
+        # Stop the worker left over from the "parent" process.
+        queue.put(_STOP)
+
+    @skipUnless(hasattr(os, 'register_at_fork'), 'requires os.fork hooks')
+    def test_reset_after_fork(self):
+        client = self.make_client()
+        client.es
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, b'1' if client._es is None else b'0')
+            os._exit(0)
+        os.close(w)
+        try:
+            self.assertEqual(os.read(r, 1), b'1')
+        finally:
+            os.close(r)
+            os.waitpid(pid, 0)
+        self.assertIsNotNone(client._es)
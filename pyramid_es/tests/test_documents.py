@@ -0,0 +1,191 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+from sqlalchemy import Column, create_engine, event, orm, types
+from sqlalchemy.ext.declarative import declarative_base
+
+from ..mixin import ElasticMixin, ESMapping, ESString
+from .data import Base, Genre, Movie, get_data
+
+
+CustomBase = declarative_base()
+
+
+class Note(CustomBase, ElasticMixin):
+    __tablename__ = 'notes'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('title')))
+
+
+class ShoutedNote(CustomBase, ElasticMixin):
+    __tablename__ = 'shouted_notes'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    elastic_mapping = Note.elastic_mapping
+
+    def elastic_document(self):
+        doc = ElasticMixin.elastic_document(self)
+        doc['title'] = doc['title'].upper()
+        doc['extra'] = 1
+        return doc
+
+
+class FilteredNote(CustomBase, ElasticMixin):
+    __tablename__ = 'filtered_notes'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            filter=lambda note: note,
+            properties=ESMapping(
+                ESString('title')))
+
+
+class TestDocuments(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('sqlite://')
+        Base.metadata.create_all(cls.engine)
+        session = orm.Session(bind=cls.engine)
+        genres, movies = get_data()
+        session.add_all(genres + movies)
+        session.commit()
+        session.close()
+
+    def setUp(self):
+        self.session = orm.Session(bind=self.engine)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_columns(self):
+        columns = Genre.elastic_columns()
+        self.assertEqual(sorted(col.key for col in columns), ['id', 'title'])
+
+    def test_columns_not_plain(self):
+        # Movie.genre_title is a Python property.
+        self.assertIsNone(Movie.elastic_columns())
+
+    def test_dependencies(self):
+        deps = Movie.elastic_dependencies()
+        self.assertEqual(deps['year'], set(['year']))
+        self.assertEqual(deps['genre_title'],
+                         set(['genre_title', 'genre', 'genre_id']))
+
+    def test_changed_fields(self):
+        drama = self.session.query(Genre).filter_by(title=u'Drama').one()
+        movie = self.session.query(Movie).filter_by(title=u'Sleeper').one()
+        self.assertEqual(movie.elastic_changed_fields(), set())
+        movie.rating = 7.4
+        movie.genre = drama
+        self.assertEqual(movie.elastic_changed_fields(),
+                         set(['rating', 'genre_title']))
+        self.assertEqual(movie.elastic_partial_document(['genre_title']),
+                         {'genre_title': u'Drama'})
+        self.session.rollback()
+
+    def test_documents_from_rows(self):
+        q = self.session.query(Genre).order_by(Genre.title)
+        batches = list(Genre.elastic_documents(q, batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+
+        expected = [(genre.elastic_identity(), genre.elastic_document())
+                    for genre in q]
+        self.assertEqual(batches[0] + batches[1], expected)
+        # No instances were loaded to build documents from rows.
+        self.session.expunge_all()
+        list(Genre.elastic_documents(q))
+        self.assertEqual(len(self.session.identity_map), 0)
+
+    def test_documents_from_instances(self):
+        q = self.session.query(Movie).filter(Movie.year < 1950)
+        batches = list(Movie.elastic_documents(q))
+        self.assertEqual(len(batches), 1)
+        docs = dict((identity[1], doc) for identity, doc in batches[0])
+        self.assertEqual(len(docs), 3)
+        metropolis = q.filter_by(title='Metropolis').one()
+        self.assertEqual(docs[metropolis.id]['genre_title'], 'Drama')
+        identities = [identity for identity, doc in batches[0]]
+        self.assertIn(metropolis.elastic_identity(), identities)
+
+    def test_relationship_paths(self):
+        self.assertEqual(Movie.elastic_relationship_paths(), [('genre',)])
+        self.assertEqual(Genre.elastic_relationship_paths(), [])
+        self.assertEqual(len(Movie.elastic_loader_options()), 1)
+
+    def test_documents_eager_load(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            q = self.session.query(Movie)
+            batches = list(Movie.elastic_documents(q, batch_size=3))
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+        self.assertEqual(len(batches), 3)
+        # One query for the movies, plus one for the genres of each batch.
+        self.assertLessEqual(len(statements), 1 + len(batches))
+
+
+class NoteMapping(ESMapping):
+
+    def __call__(self, instance):
+        doc = ESMapping.__call__(self, instance)
+        doc['kind'] = 'note'
+        return doc
+
+
+class CalledNote(CustomBase, ElasticMixin):
+    __tablename__ = 'called_notes'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    @classmethod
+    def elastic_mapping(cls):
+        return NoteMapping(
+            properties=ESMapping(
+                ESString('title')))
+
+
+class TestCustomDocuments(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        CustomBase.metadata.create_all(engine)
+        self.session = orm.Session(bind=engine)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_plain(self):
+        self.assertIsNotNone(Note.elastic_columns())
+
+    def test_not_from_rows(self):
+        self.assertIsNone(ShoutedNote.elastic_columns())
+        self.assertIsNone(FilteredNote.elastic_columns())
+        self.assertIsNone(CalledNote.elastic_columns())
+
+    def test_overridden_document(self):
+        self.session.add(ShoutedNote(id=1, title=u'hello'))
+        self.session.flush()
+        q = self.session.query(ShoutedNote)
+        [batch] = list(ShoutedNote.elastic_documents(q))
+        note = q.one()
+        self.assertEqual(batch, [(note.elastic_identity(),
+                                  note.elastic_document())])
+        self.assertEqual(batch[0][1], {'_id': 1, 'title': u'HELLO',
+                                       'extra': 1})
@@ -4,6 +4,7 @@ from unittest import TestCase
 from pprint import pprint
 
 from elasticsearch.exceptions import NotFoundError
+from sqlalchemy import create_engine, orm
 
 from ..client import ElasticClient
 
@@ -50,6 +51,12 @@ class TestClient(TestCase):
         self.client.ensure_index(recreate=True)
         self.client.ensure_all_mappings(Base)
 
+    def test_sync_mappings(self):
+        self.client.ensure_index(recreate=True)
+        changes = self.client.sync_mappings(Base)
+        self.assertEqual(changes, {'Genre': 'created', 'Movie': 'created'})
+        self.assertEqual(self.client.sync_mappings(Base), {})
+
     def test_get_mappings(self):
         mapping = self.client.get_mappings(Movie)
         self.assertIn('Movie', mapping)
@@ -121,6 +128,31 @@ class TestClient(TestCase):
 
         # FIXME Search for this object and make sure it DOES NOT exist.
 
+    def test_reindex(self):
+        self.client.ensure_index(recreate=True)
+        self.client.ensure_mapping(Genre)
+        self.client.ensure_mapping(Movie)
+
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = orm.Session(bind=engine)
+        genres, movies = get_data()
+        session.add_all(genres + movies)
+        session.flush()
+
+        progress = []
+        num = self.client.reindex(Genre, session)
+        self.assertEqual(num, 4)
+        num = self.client.reindex(Movie, session, chunk_size=3,
+                                  progress=lambda *args: progress.append(args))
+        self.assertEqual(num, 8)
+        self.assertEqual([count for count, elapsed in progress], [3, 6, 8])
+        self.client.refresh()
+
+        self.assertEqual(self.client.query(Genre).count(), 4)
+        self.assertEqual(self.client.query(Movie).count(), 8)
+        session.close()
+
     def test_delete_nonexistent_document(self):
         with self.assertRaises(NotFoundError):
             self.client.delete_document(id=1337,
@@ -0,0 +1,100 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import TestCase
+
+from ..hashcache import document_hash, LRUHashCache, ShelveHashCache
+
+
+class TestDocumentHash(TestCase):
+
+    def test_stable(self):
+        self.assertEqual(document_hash({'a': 1, 'b': [1, 2]}),
+                         document_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(document_hash({'a': 1}),
+                            document_hash({'a': 2}))
+
+    def test_non_json_values(self):
+        self.assertEqual(document_hash({'rating': Decimal('7.5')}),
+                         document_hash({'rating': Decimal('7.5')}))
+
+
+class TestLRUHashCache(TestCase):
+
+    def test_check(self):
+        cache = LRUHashCache()
+        key = ('Thing', 1, None)
+        self.assertFalse(cache.check(key, 'abc'))
+        cache.set(key, 'abc')
+        self.assertTrue(cache.check(key, 'abc'))
+        self.assertFalse(cache.check(key, 'def'))
+        self.assertEqual(cache.checked, 3)
+        self.assertEqual(cache.skipped, 1)
+        self.assertAlmostEqual(cache.skip_ratio, 1 / 3)
+
+        cache.discard(key)
+        self.assertFalse(cache.check(key, 'abc'))
+
+    def test_eviction(self):
+        cache = LRUHashCache(maxsize=2)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        # Touch 1, so that 2 is the least recently used.
+        self.assertTrue(cache.check(1, 'a'))
+        cache.set(3, 'c')
+        self.assertEqual(list(cache.hashes), [1, 3])
+
+    def test_clear(self):
+        cache = LRUHashCache()
+        cache.set(1, 'a')
+        cache.clear()
+        self.assertFalse(cache.check(1, 'a'))
+
+    def test_empty_ratio(self):
+        self.assertEqual(LRUHashCache().skip_ratio, 0.0)
+
+
+class TestShelveHashCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'hashes')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_persistent(self):
+        key = ('Movie', 'abc', 'xyz')
+        cache = ShelveHashCache(self.path)
+        cache.set(key, '123')
+        cache.close()
+
+        cache = ShelveHashCache(self.path)
+        self.assertTrue(cache.check(key, '123'))
+        cache.discard(key)
+        self.assertFalse(cache.check(key, '123'))
+        cache.close()
+
+    def test_clear(self):
+        cache = ShelveHashCache(self.path)
+        cache.set(('Movie', 'abc', None), '123')
+        cache.clear()
+        self.assertFalse(cache.check(('Movie', 'abc', None), '123'))
+        cache.close()
+
+    def test_opened_per_process(self):
+        key = ('Movie', 'abc', None)
+        cache = ShelveHashCache(self.path)
+        self.assertIsNone(cache._db)
+        cache.set(key, '123')
+        db = cache.db
+        # As if the cache had been inherited by a forked process.
+        cache._db_pid = -1
+        self.assertIsNot(cache.db, db)
+        db.close()
+        self.assertTrue(cache.check(key, '123'))
+        cache.close()
+        self.assertIsNone(cache._db)
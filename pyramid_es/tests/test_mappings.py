@@ -0,0 +1,123 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import copy
+import threading
+from unittest import TestCase
+
+from ..client import ElasticClient, _mapped_classes, _mapping_subset
+from ..hashcache import LRUHashCache
+
+from .data import Base, Genre, Movie
+
+
+class FakeIndices(object):
+
+    def __init__(self, mappings):
+        self.mappings = mappings
+        self.put = []
+        self.lock = threading.Lock()
+
+    def get_mapping(self, index, doc_type=None):
+        return {index: {'mappings': copy.deepcopy(self.mappings)}}
+
+    def put_mapping(self, index, doc_type, body):
+        with self.lock:
+            self.put.append(doc_type)
+
+    def delete_mapping(self, index, doc_type):
+        self.mappings.pop(doc_type, None)
+
+    def exists(self, index):
+        return True
+
+    def create(self, index, body):
+        pass
+
+    def delete(self, index):
+        self.mappings = {}
+
+
+class FakeES(object):
+
+    def __init__(self, mappings):
+        self.indices = FakeIndices(mappings)
+
+
+class TestSyncMappings(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['localhost:9200'],
+                                    index='pyramid_es_tests')
+
+    def test_mapped_classes(self):
+        self.assertEqual(sorted(cls.__name__
+                                for cls in _mapped_classes(Base)),
+                         ['Genre', 'Movie'])
+
+    def test_subset(self):
+        self.assertTrue(_mapping_subset(
+            {'properties': {'title': {'type': 'string', 'boost': 5.0}}},
+            {'properties': {'title': {'type': 'string', 'boost': '5.0',
+                                      'store': False}},
+             '_all': {'enabled': True}}))
+        self.assertFalse(_mapping_subset(
+            {'properties': {'title': {'type': 'string'}}},
+            {'properties': {'title': {'type': 'long'}}}))
+        self.assertFalse(_mapping_subset(
+            {'properties': {'title': {'type': 'string'}}},
+            {'properties': {}}))
+
+    def test_sync(self):
+        genre = copy.deepcopy(Genre.elastic_mapping_dict())
+        genre['_all'] = {'enabled': True}
+        self.client.es = FakeES({'Genre': genre})
+        changes = self.client.sync_mappings(Base)
+        self.assertEqual(changes, {'Movie': 'created'})
+        self.assertEqual(self.client.es.indices.put, ['Movie'])
+
+    def test_sync_changed(self):
+        movie = copy.deepcopy(Movie.elastic_mapping_dict())
+        del movie['properties']['director']
+        self.client.es = FakeES({
+            'Genre': Genre.elastic_mapping_dict(),
+            'Movie': movie,
+        })
+        changes = self.client.sync_mappings(Base)
+        self.assertEqual(changes, {'Movie': 'updated'})
+
+    def test_sync_nothing_changed(self):
+        self.client.es = FakeES({
+            'Genre': Genre.elastic_mapping_dict(),
+            'Movie': Movie.elastic_mapping_dict(),
+        })
+        self.assertEqual(self.client.sync_mappings(Base), {})
+        self.assertEqual(self.client.es.indices.put, [])
+
+
+class TestHashCacheCleared(TestCase):
+
+    def setUp(self):
+        self.cache = LRUHashCache()
+        self.client = ElasticClient(servers=['localhost:9200'],
+                                    index='pyramid_es_tests',
+                                    hash_cache=self.cache)
+        self.client.es = FakeES({})
+
+    def assertCleared(self, f, *args, **kwargs):
+        key = ('Movie', 'abc', None)
+        self.cache.set(key, '123')
+        f(*args, **kwargs)
+        self.assertFalse(self.cache.check(key, '123'))
+
+    def test_ensure_index(self):
+        self.cache.set(('Movie', 'abc', None), '123')
+        self.client.ensure_index()
+        self.assertTrue(self.cache.check(('Movie', 'abc', None), '123'))
+        self.assertCleared(self.client.ensure_index, recreate=True)
+
+    def test_delete_index(self):
+        self.assertCleared(self.client.delete_index)
+
+    def test_mappings(self):
+        self.assertCleared(self.client.ensure_mapping, Movie, recreate=True)
+        self.assertCleared(self.client.delete_mapping, Movie)
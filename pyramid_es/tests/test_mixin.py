@@ -78,6 +78,91 @@ class TestMixin(TestCase):
         self.assertEqual(doc['_id'], 2)
         self.assertEqual(doc['child']['_id'], 1)
 
+    def test_compile(self):
+        mapping = ESMapping(
+            analyzer='lowercase',
+            properties=ESMapping(
+                ESColor('foreground'),
+                ESString('id', attr='id'),
+                child=dict(
+                    analyzer='lowercase',
+                    properties=ESMapping(
+                        ESColor('foreground')))))
+
+        thing1 = Thing(id=1,
+                       foreground=(40, 20, 27))
+        thing2 = Thing(id=2,
+                       foreground=(37, 88, 19),
+                       child=thing1)
+
+        extract = mapping.compile()
+        self.assertEqual(extract(thing2), mapping(thing2))
+        self.assertEqual(extract(thing2)['child']['foreground'], '#28141b')
+
+    def test_compile_custom_call(self):
+        class ESUpper(ESProp):
+            def __call__(self, instance):
+                return getattr(instance, self.name).upper()
+
+        mapping = ESMapping(properties=ESMapping(ESUpper('name')))
+        thing = Thing(id=3, foreground=None)
+        thing.name = 'widget'
+        self.assertEqual(mapping.compile()(thing), {'_id': 3,
+                                                    'name': 'WIDGET'})
+
+    def test_extractor_cached_per_class(self):
+        calls = []
+
+        class Base(ElasticMixin):
+            def __init__(self, id, name):
+                self.id = id
+                self.name = name
+
+            @classmethod
+            def elastic_mapping(cls):
+                calls.append(cls)
+                return ESMapping(properties=ESMapping(ESString('name')))
+
+        class Sub(Base):
+            @classmethod
+            def elastic_mapping(cls):
+                calls.append(cls)
+                return ESMapping(properties=ESMapping(ESString('id')))
+
+        self.assertEqual(Base(1, 'a').elastic_document(),
+                         {'_id': 1, 'name': 'a'})
+        self.assertEqual(Base(2, 'b').elastic_document(),
+                         {'_id': 2, 'name': 'b'})
+        self.assertEqual(Sub(3, 'c').elastic_document(),
+                         {'_id': 3, 'id': 3})
+        self.assertEqual(calls, [Base, Sub])
+
+    def test_mapping_dict_cached(self):
+        calls = []
+
+        class Parent(ElasticMixin):
+            pass
+
+        class Child(ElasticMixin):
+            __elastic_parent__ = ('Parent', 'parent_id')
+
+            @classmethod
+            def elastic_mapping(cls):
+                calls.append(cls)
+                return ESMapping(
+                    analyzer='content',
+                    properties=ESMapping(ESString('name', boost=2.0)))
+
+        d = Child.elastic_mapping_dict()
+        self.assertEqual(d['analyzer'], 'content')
+        self.assertEqual(d['properties'],
+                         {'name': {'type': 'string', 'boost': 2.0}})
+        self.assertEqual(d['_parent'], {'type': 'Parent'})
+        self.assertIs(Child.elastic_mapping_dict(), d)
+        self.assertIs(Child.elastic_cached_mapping(),
+                      Child.elastic_cached_mapping())
+        self.assertEqual(calls, [Child])
+
     def test_contains(self):
         mapping = ESMapping(
             ESString("name"),
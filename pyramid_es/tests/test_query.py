@@ -0,0 +1,293 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+from ..client import ElasticClient
+from ..query import ElasticQuery, encode_cursor, decode_cursor
+
+
+def hit(n):
+    return {'_id': n, '_type': 'Thing', '_source': {'n': n},
+            'sort': [n, 'Thing#%d' % n]}
+
+
+class FakeClient(object):
+    """
+    Serves ``total`` hits from searches, without sorting or filtering.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.searches = []
+        self.scrolls = []
+        self.cleared = []
+
+    def search(self, body, classes=None, fields=None, **params):
+        self.searches.append((body, params))
+        size = params['size']
+        if 'scroll' in params:
+            self.scroll_size = size
+            self.scroll_pos = 0
+            res = self._response(0, 0 if params.get('search_type') == 'scan'
+                                 else size)
+            self.scroll_pos = len(res['hits']['hits'])
+            res['_scroll_id'] = 'scroll-%d' % len(self.searches)
+            return res
+        return self._response(params.get('from_', 0), size)
+
+    def scroll(self, scroll_id, scroll='5m'):
+        self.scrolls.append(scroll_id)
+        res = self._response(self.scroll_pos, self.scroll_size)
+        self.scroll_pos += len(res['hits']['hits'])
+        res['_scroll_id'] = scroll_id
+        return res
+
+    def clear_scroll(self, scroll_id):
+        self.cleared.append(scroll_id)
+
+    def _response(self, start, size):
+        return {'hits': {'total': self.total,
+                         'hits': [hit(n) for n in
+                                  range(start, min(start + size,
+                                                   self.total))]}}
+
+
+class TestScan(TestCase):
+
+    def test_scan(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).add_term_facet('color', 10, 'color')
+        records = list(q.scan(size=10))
+        self.assertEqual([r.n for r in records], list(range(25)))
+        body, params = client.searches[0]
+        self.assertEqual(params['search_type'], 'scan')
+        self.assertNotIn('facets', body)
+        # An empty first page, three pages of hits, then an empty page.
+        self.assertEqual(len(client.scrolls), 4)
+        self.assertEqual(client.cleared, ['scroll-1'])
+
+    def test_scan_sorted(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).order_by('n')
+        records = list(q.iter_all(size=10))
+        self.assertEqual(len(records), 25)
+        body, params = client.searches[0]
+        self.assertNotIn('search_type', params)
+        self.assertEqual(len(client.scrolls), 3)
+
+    def test_scan_offset_limit(self):
+        client = FakeClient(100)
+        q = ElasticQuery(client).offset(15).limit(12)
+        records = list(q.scan(size=10))
+        self.assertEqual([r.n for r in records], list(range(15, 27)))
+        self.assertEqual(len(client.scrolls), 3)
+        self.assertEqual(client.cleared, ['scroll-1'])
+
+    def test_scan_stopped_early(self):
+        client = FakeClient(100)
+        it = ElasticQuery(client).scan(size=10)
+        for n, record in zip(range(5), it):
+            pass
+        it.close()
+        self.assertEqual(len(client.scrolls), 1)
+        self.assertEqual(client.cleared, ['scroll-1'])
+
+
+class TestCursor(TestCase):
+
+    def test_cursor_round_trip(self):
+        values = [1959, u'Thing#abc']
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor')
+
+    def test_first_page(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).order_by('n', desc=True)
+        result = q.page(10)
+        body, params = client.searches[0]
+        self.assertEqual(body['sort'], [{'n': {'order': 'desc'}},
+                                        {'_uid': {'order': 'asc'}}])
+        self.assertNotIn('filtered', body['query'])
+        self.assertEqual(params['size'], 11)
+        self.assertEqual(len(list(result)), 10)
+        self.assertEqual(decode_cursor(result.cursor), [9, 'Thing#9'])
+
+    def test_next_page(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).filter_term('color', 'red').order_by('n')
+        q.page(10, cursor=encode_cursor([9, 'Thing#9']))
+        body, params = client.searches[0]
+        self.assertEqual(params['from_'], 0)
+        resume = body['query']['filtered']['filter']['and'][1]
+        self.assertEqual(resume, {'or': [
+            {'range': {'n': {'gt': 9}}},
+            {'and': [{'term': {'n': 9}},
+                     {'range': {'_uid': {'gt': 'Thing#9'}}}]},
+        ]})
+
+    def test_last_page(self):
+        client = FakeClient(5)
+        result = ElasticQuery(client).order_by('n').page(10)
+        self.assertIsNone(result.cursor)
+
+    def test_exact_last_page(self):
+        client = FakeClient(10)
+        result = ElasticQuery(client).order_by('n').page(10)
+        self.assertEqual(len(list(result)), 10)
+        self.assertIsNone(result.cursor)
+
+    def test_mismatched_cursor(self):
+        q = ElasticQuery(FakeClient(5)).order_by('n')
+        with self.assertRaises(ValueError):
+            q.after(encode_cursor([1]))
+        with self.assertRaises(ValueError):
+            q.order_by('_score').after(None)
+
+
+class TestLazyExecute(TestCase):
+
+    def sizes(self, client):
+        return [(params['from_'], params['size'])
+                for body, params in client.searches]
+
+    def test_stop_early(self):
+        client = FakeClient(1000)
+        result = ElasticQuery(client).execute(lazy=True)
+        records = []
+        for record in result:
+            records.append(record.n)
+            if len(records) == 30:
+                break
+        self.assertEqual(records, list(range(30)))
+        self.assertEqual(self.sizes(client), [(0, 20), (20, 100)])
+
+    def test_exhaust(self):
+        client = FakeClient(700)
+        result = ElasticQuery(client).execute(lazy=True)
+        self.assertEqual(len(list(result)), 700)
+        self.assertEqual(self.sizes(client),
+                         [(0, 20), (20, 100), (120, 500), (620, 500)])
+        # Iterating again doesn't fetch anything more.
+        self.assertEqual(len(list(result)), 700)
+        self.assertEqual(len(client.searches), 4)
+        self.assertEqual(result.total, 700)
+
+    def test_size(self):
+        client = FakeClient(1000)
+        result = ElasticQuery(client).execute(start=10, size=50, lazy=True)
+        self.assertEqual([r.n for r in result], list(range(10, 60)))
+        self.assertEqual(self.sizes(client), [(10, 20), (30, 30)])
+
+    def test_limit(self):
+        client = FakeClient(1000)
+        result = ElasticQuery(client).limit(30).execute(lazy=True)
+        self.assertEqual([r.n for r in result], list(range(30)))
+        self.assertEqual(self.sizes(client), [(0, 20), (20, 10)])
+
+    def test_offset_limit(self):
+        client = FakeClient(1000)
+        q = ElasticQuery(client).offset(5).limit(30)
+        self.assertEqual([r.n for r in q.execute(lazy=True)],
+                         list(range(5, 35)))
+        self.assertEqual([r.n for r in q.execute(lazy=True)],
+                         [r.n for r in q.execute()])
+        self.assertEqual([r.n for r in q.execute(start=10, size=5,
+                                                 lazy=True)],
+                         list(range(15, 20)))
+
+
+class FakeMultiSearchES(object):
+
+    def __init__(self):
+        self.bodies = []
+
+    def msearch(self, body):
+        self.bodies.append(body)
+        responses = []
+        for header, query in zip(body[::2], body[1::2]):
+            if header.get('type') == 'Broken':
+                responses.append({'error': 'SearchPhaseExecutionException'})
+            else:
+                responses.append(
+                    FakeClient(30)._response(query['from'], query['size']))
+        return {'responses': responses}
+
+
+class TestMultiExecute(TestCase):
+
+    def test_multi_execute(self):
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests')
+        client.es = FakeMultiSearchES()
+        q = client.query('Thing').filter_term('color', 'red')
+        results = client.multi_execute([
+            q.limit(5),
+            (q, dict(start=10, size=3, fields=['n'])),
+            (client.query('Thing'), dict(size=0)),
+            client.query('Broken'),
+        ])
+        [body] = client.es.bodies
+        self.assertEqual(len(body), 8)
+        self.assertEqual(body[0], {'index': 'pyramid_es_tests',
+                                   'type': 'Thing'})
+        self.assertEqual(body[1]['query'], q._compile()['query'])
+        self.assertEqual(body[3]['fields'], ['n'])
+
+        self.assertEqual([len(list(r)) for r in results[:3]], [5, 3, 0])
+        self.assertEqual([r.n for r in results[1]], [10, 11, 12])
+        self.assertEqual(results[2].total, 30)
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[3].error, 'SearchPhaseExecutionException')
+
+    def test_empty(self):
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests')
+        self.assertEqual(client.multi_execute([]), [])
+
+
+class TestCompiledBody(TestCase):
+
+    def test_cached(self):
+        client = FakeClient(100)
+        q = ElasticQuery(client).filter_term('color', 'red').order_by('n')
+        calls = []
+        build = q._build_body
+
+        def counting_build():
+            calls.append(1)
+            return build()
+        q._build_body = counting_build
+
+        q.execute(size=10)
+        q.execute(start=10, size=10)
+        q.count()
+        self.assertEqual(len(calls), 1)
+        bodies = [body for body, params in client.searches]
+        self.assertIs(bodies[0], bodies[1])
+        self.assertEqual([params['from_'] for body, params in
+                          client.searches], [0, 10, 0])
+
+    def test_generate_clears_cache(self):
+        q = ElasticQuery(FakeClient(100)).filter_term('color', 'red')
+        body = q._compile()
+        q2 = q.filter_term('size', 'large')
+        self.assertIsNot(q2._compile(), body)
+        self.assertEqual(len(q2._compile()['query']['filtered']['filter']
+                             ['and']), 2)
+        self.assertIs(q._compile(), body)
+
+    def test_scan_leaves_cached_body(self):
+        client = FakeClient(10)
+        q = ElasticQuery(client).add_term_facet('color', 10, 'color')
+        list(q.scan())
+        self.assertIn('facets', q._compile())
+
+    def test_body_hash(self):
+        client = FakeClient(100)
+        q1 = ElasticQuery(client).filter_term('color', 'red')
+        q2 = ElasticQuery(client).filter_term('color', 'red')
+        q3 = ElasticQuery(client).filter_term('color', 'blue')
+        self.assertEqual(q1.body_hash, q2.body_hash)
+        self.assertEqual(q1.body_hash, q1.offset(10).body_hash)
+        self.assertNotEqual(q1.body_hash, q3.body_hash)
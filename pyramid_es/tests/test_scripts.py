@@ -0,0 +1,110 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import create_engine, orm
+
+from ..scripts.reindex import (partition_ranges, range_query,
+                               load_checkpoint, save_checkpoint, reindex)
+
+from .data import Base, Movie, get_data
+
+
+class TestReindexScript(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.db_url = 'sqlite:///' + os.path.join(cls.tmpdir, 'movies.db')
+        engine = create_engine(cls.db_url)
+        Base.metadata.create_all(engine)
+        session = orm.Session(bind=engine)
+        genres, movies = get_data()
+        session.add_all(genres + movies)
+        session.commit()
+        session.close()
+        engine.dispose()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.engine = create_engine(self.db_url)
+        self.session = orm.Session(bind=self.engine)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def test_partition_ranges(self):
+        ranges = partition_ranges(self.session, Movie, 3)
+        self.assertEqual(len(ranges), 3)
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+
+        counts = [range_query(self.session, Movie, lower, upper).count()
+                  for lower, upper in ranges]
+        self.assertEqual(counts, [3, 3, 2])
+
+        ids = set()
+        for lower, upper in ranges:
+            ids.update(movie.id for movie in
+                       range_query(self.session, Movie, lower, upper))
+        self.assertEqual(len(ids), 8)
+
+    def test_more_partitions_than_rows(self):
+        ranges = partition_ranges(self.session, Movie, 20)
+        self.assertEqual(len(ranges), 8)
+
+    def test_checkpoint(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        self.assertIsNone(load_checkpoint(path, 'myapp:Movie'))
+        checkpoint = {'class': 'myapp:Movie',
+                      'ranges': [[None, 'abc'], ['abc', None]],
+                      'done': [1]}
+        save_checkpoint(path, checkpoint)
+        self.assertEqual(load_checkpoint(path, 'myapp:Movie'), checkpoint)
+        self.assertIsNone(load_checkpoint(path, 'myapp:Genre'))
+        os.remove(path)
+
+    def test_checkpoint_key_types(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        bounds = [uuid.UUID(int=1), date(1958, 5, 9),
+                  datetime(2015, 1, 2, 3, 4, 5),
+                  datetime(2015, 1, 2, 3, 4, 5, 6), Decimal('12.50')]
+        checkpoint = {'class': 'myapp:Movie',
+                      'ranges': [[None, bound] for bound in bounds],
+                      'done': []}
+        save_checkpoint(path, checkpoint)
+        self.assertEqual(load_checkpoint(path, 'myapp:Movie'), checkpoint)
+        os.remove(path)
+
+        checkpoint['ranges'] = [[None, object()]]
+        with self.assertRaises(TypeError):
+            save_checkpoint(path, checkpoint)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_reindex(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        settings = {
+            'sqlalchemy.url': self.db_url,
+            'elastic.index': 'pyramid_es_tests',
+            'elastic.disable_indexing': True,
+        }
+        # Pretend a previous run got through the first range.
+        ranges = partition_ranges(self.session, Movie, 4)
+        save_checkpoint(path, {'class': 'pyramid_es.tests.data:Movie',
+                               'ranges': ranges,
+                               'done': [0]})
+
+        total = reindex(settings, 'pyramid_es.tests.data:Movie',
+                        processes=2, checkpoint_path=path)
+        self.assertEqual(total, 6)
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,71 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import TestCase, skipIf
+
+from elasticsearch.exceptions import SerializationError
+
+from .. import client_from_config
+from ..serializer import JSONSerializer, OrjsonSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class TestJSONSerializer(TestCase):
+    serializer_class = JSONSerializer
+
+    def setUp(self):
+        self.serializer = self.serializer_class()
+
+    def test_types(self):
+        doc = {'rating': Decimal('8.5'),
+               'missing': Decimal('NaN'),
+               'released': date(1958, 5, 9),
+               'updated': datetime(2015, 1, 2, 3, 4, 5),
+               'uuid': uuid.UUID(int=1),
+               'title': u'Vertigo \u2014 Hitchcock'}
+        s = self.serializer.dumps(doc)
+        self.assertEqual(json.loads(s),
+                         {'rating': 8.5,
+                          'missing': None,
+                          'released': '1958-05-09',
+                          'updated': '2015-01-02T03:04:05',
+                          'uuid': '00000000-0000-0000-0000-000000000001',
+                          'title': u'Vertigo \u2014 Hitchcock'})
+
+    def test_strings_passed_through(self):
+        self.assertEqual(self.serializer.dumps('{"a":1}'), '{"a":1}')
+
+    def test_loads(self):
+        self.assertEqual(self.serializer.loads('{"hits":[1,2]}'),
+                         {'hits': [1, 2]})
+
+    def test_errors(self):
+        with self.assertRaises(SerializationError):
+            self.serializer.dumps({'obj': object()})
+        with self.assertRaises(SerializationError):
+            self.serializer.loads('{')
+
+
+@skipIf(orjson is None, 'orjson is not installed')
+class TestOrjsonSerializer(TestJSONSerializer):
+    serializer_class = OrjsonSerializer
+
+
+class TestSerializerSetting(TestCase):
+
+    def test_setting(self):
+        client = client_from_config({
+            'elastic.index': 'pyramid_es_tests',
+            'elastic.serializer': 'pyramid_es.serializer.JSONSerializer',
+        })
+        self.assertIsInstance(client.es.transport.serializer, JSONSerializer)
+        deserializer = client.es.transport.deserializer
+        self.assertIs(deserializer.serializers['application/json'],
+                      client.es.transport.serializer)
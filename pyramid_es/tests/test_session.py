@@ -0,0 +1,158 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+from elasticsearch import Elasticsearch
+from sqlalchemy import create_engine, orm
+
+from ..client import ElasticClient
+from ..session import register
+
+from .data import Base, Genre, Movie, Unindexed
+
+
+class MissingDocumentES(object):
+    """
+    Answers bulk requests as if none of the documents were indexed.
+    """
+
+    def __init__(self):
+        self.transport = Elasticsearch().transport
+        self.requests = 0
+
+    def bulk(self, body):
+        self.requests += 1
+        items = []
+        for line in body.splitlines():
+            op = list(self.transport.serializer.loads(line))[0]
+            if op in ('index', 'update', 'delete'):
+                items.append({op: {'status': 201 if op == 'index' else 404,
+                                   'error': 'DocumentMissingException'}})
+        return {'errors': True, 'items': items}
+
+
+class TestSessionIndexing(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = orm.Session(bind=self.engine)
+
+        self.sent = []
+        self.client = ElasticClient(servers=['localhost:9200'],
+                                    index='pyramid_es_tests',
+                                    use_transaction=True)
+        self.client.bulk = lambda actions: self.sent.extend(actions)
+        register(self.session, self.client)
+
+    def tearDown(self):
+        transaction.abort()
+        self.session.close()
+
+    def test_index_once_per_transaction(self):
+        with transaction.manager:
+            genre = Genre(title=u'Western')
+            self.session.add(genre)
+            self.session.add(Unindexed(id=1))
+            self.session.flush()
+
+            movie = Movie(title=u'Rio Bravo', genre=genre,
+                          genre_id=genre.id)
+            self.session.add(movie)
+            self.session.flush()
+            movie.year = 1959
+            self.session.flush()
+            movie.director = u'Howard Hawks'
+            self.session.flush()
+
+            self.assertEqual(len(self.client.uncommitted), 0)
+            self.session.commit()
+
+        self.assertEqual(sorted(action.doc_type for action in self.sent),
+                         ['Genre', 'Movie'])
+        doc = [action.doc for action in self.sent
+               if action.doc_type == 'Movie'][0]
+        self.assertEqual(doc['year'], 1959)
+        self.assertEqual(doc['director'], u'Howard Hawks')
+        self.assertEqual(doc['genre_title'], u'Western')
+
+    def test_delete(self):
+        with transaction.manager:
+            genre = Genre(title=u'Musical')
+            self.session.add(genre)
+            self.session.flush()
+            self.session.delete(genre)
+            self.session.flush()
+            self.session.commit()
+
+        self.assertEqual(len(self.sent), 1)
+        action = self.sent[0]
+        self.assertEqual(action.op_type, 'delete')
+        self.assertEqual(action.key, ('Genre', genre.id, None))
+        self.assertTrue(action.safe)
+
+    def test_rolled_back_insert(self):
+        with transaction.manager:
+            self.session.add(Genre(title=u'Film Noir'))
+            self.session.flush()
+            self.session.rollback()
+
+        self.assertEqual(self.sent, [])
+
+    def test_without_transaction(self):
+        self.client.use_transaction = False
+        indexed = []
+        self.client.index_object = indexed.append
+
+        genre = Genre(title=u'Horror')
+        self.session.add(genre)
+        self.session.flush()
+        self.assertEqual(indexed, [genre])
+
+    def test_partial(self):
+        session = orm.Session(bind=self.engine)
+        register(session, self.client, partial=True)
+        with transaction.manager:
+            genre = Genre(title=u'Thriller')
+            movie = Movie(title=u'Rear Window', genre=genre,
+                          genre_id=genre.id, year=1954)
+            session.add_all([genre, movie])
+            session.commit()
+        del self.sent[:]
+
+        with transaction.manager:
+            movie.rating = 8.5
+            session.flush()
+            movie.director = u'Alfred Hitchcock'
+            session.flush()
+            session.commit()
+        session.close()
+
+        [action] = self.sent
+        self.assertEqual(action.op_type, 'update')
+        self.assertEqual(action.doc, {'rating': 8.5,
+                                      'director': u'Alfred Hitchcock'})
+        self.assertTrue(action.safe)
+
+    def test_partial_missing_document(self):
+        # The document was never indexed, for instance because the row was
+        # created before indexing was enabled.
+        with transaction.manager:
+            genre = Genre(title=u'Mystery')
+            self.session.add(genre)
+            self.session.commit()
+
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests',
+                               use_transaction=True)
+        client.es = MissingDocumentES()
+        session = orm.Session(bind=self.engine)
+        register(session, client, partial=True)
+        with transaction.manager:
+            genre = session.query(Genre).filter_by(title=u'Mystery').one()
+            genre.title = u'Whodunit'
+            session.flush()
+            session.commit()
+        session.close()
+        self.assertEqual(client.es.requests, 1)
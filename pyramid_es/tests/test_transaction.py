@@ -1,12 +1,16 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import json
+import threading
 from unittest import TestCase
 
 import transaction
+from elasticsearch import Elasticsearch
 from sqlalchemy import Column, types
 from sqlalchemy.ext.declarative import declarative_base
 
-from ..client import ElasticClient
+from ..client import ElasticClient, join_transaction
+from ..hashcache import document_hash, LRUHashCache
 from ..mixin import ElasticMixin, ESMapping, ESString
 
 
@@ -26,6 +30,225 @@ class Todo(Base, ElasticMixin):
                 ESString('description', boost=5.0)))
 
 
+class FakeBulkES(object):
+    """
+    Answers every bulk action with the given status. Requests block while
+    ``release`` is cleared.
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self.bodies = []
+        self.transport = Elasticsearch().transport
+        self.release = threading.Event()
+        self.release.set()
+
+    def bulk(self, body):
+        self.release.wait()
+        lines = body.splitlines()
+        self.bodies.append(lines)
+        items = [{op: {'status': self.status}}
+                 for op in (list(json.loads(line))[0] for line in lines)
+                 if op in ('index', 'update', 'delete')]
+        return {'errors': self.status >= 300, 'items': items}
+
+
+class TestQueue(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['localhost:9200'],
+                                    index='pyramid_es_tests_txn',
+                                    use_transaction=True)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def test_repeated_index_coalesced(self):
+        todo = Todo(id=1, description='First draft')
+        self.client.index_object(todo)
+        todo.description = 'Second draft'
+        self.client.index_object(todo)
+
+        actions = list(self.client.uncommitted)
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(actions[0].op_type, 'index')
+        self.assertEqual(actions[0].doc['description'], 'Second draft')
+
+    def test_index_then_delete_coalesced(self):
+        todo = Todo(id=2, description='Short lived')
+        self.client.index_object(todo)
+        self.client.delete_object(todo)
+
+        actions = list(self.client.uncommitted)
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(actions[0].op_type, 'delete')
+        self.assertTrue(actions[0].safe)
+
+    def test_index_then_delete_sent(self):
+        # The document never reached the server, so the delete misses.
+        self.client.es = FakeBulkES(status=404)
+        todo = Todo(id=2, description='Short lived')
+        self.client.index_object(todo)
+        self.client.delete_object(todo)
+        transaction.commit()
+        [lines] = self.client.es.bodies
+        self.assertEqual(len(lines), 1)
+        self.assertIn('delete', json.loads(lines[0]))
+
+    def test_delete_does_not_build_document(self):
+        class ExpensiveTodo(ElasticMixin):
+            elastic_mapping = Todo.elastic_mapping
+
+            def __init__(self, id):
+                self.id = id
+
+            @property
+            def description(self):
+                raise AssertionError('description should not be loaded')
+
+        self.client.delete_object(ExpensiveTodo(id=3))
+        actions = list(self.client.uncommitted)
+        self.assertEqual(actions[0].key, ('ExpensiveTodo', 3, None))
+
+    def test_skip_unchanged(self):
+        self.client.hash_cache = cache = LRUHashCache()
+        todo = Todo(id=5, description='Already indexed')
+        cache.set(('Todo', 5, None),
+                  document_hash({'description': 'Already indexed'}))
+
+        self.client.index_object(todo)
+        self.assertEqual(len(self.client.uncommitted), 0)
+        self.assertEqual(cache.skip_ratio, 1.0)
+
+        todo.description = 'Changed'
+        self.client.index_object(todo)
+        self.assertEqual(len(self.client.uncommitted), 1)
+
+        # A write identical to the cached document must not be skipped while
+        # a different write for the same document is pending.
+        todo.description = 'Already indexed'
+        self.client.index_object(todo)
+        actions = list(self.client.uncommitted)
+        self.assertEqual(actions[0].doc['description'], 'Already indexed')
+        self.assertEqual(cache.checked, 2)
+
+    def test_distinct_documents_kept(self):
+        for i in range(3):
+            self.client.index_object(Todo(id=i, description='Item'))
+        self.client.delete_document(id=1, doc_type='Other')
+        self.assertEqual(len(self.client.uncommitted), 4)
+
+    def test_savepoint_rollback(self):
+        todo = Todo(id=1, description='Before savepoint')
+        self.client.index_object(todo)
+
+        sp = transaction.savepoint()
+        todo.description = 'After savepoint'
+        self.client.index_object(todo)
+        self.client.index_object(Todo(id=2, description='Also after'))
+        sp.rollback()
+
+        actions = list(self.client.uncommitted)
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(actions[0].doc['description'], 'Before savepoint')
+
+    def test_nested_savepoints(self):
+        outer = transaction.savepoint()
+        self.client.index_object(Todo(id=1, description='One'))
+        inner = transaction.savepoint()
+        self.client.delete_object(Todo(id=1, description='One'))
+        self.client.index_object(Todo(id=2, description='Two'))
+
+        inner.rollback()
+        self.assertEqual([action.op_type
+                          for action in self.client.uncommitted], ['index'])
+        outer.rollback()
+        self.assertEqual(len(self.client.uncommitted), 0)
+
+    def test_concurrent_transactions(self):
+        self.client.index_object(Todo(id=1, description='Main thread'))
+
+        queued = []
+
+        def worker(n):
+            txn = transaction.begin()
+            try:
+                for i in range(n):
+                    self.client.index_object(
+                        Todo(id=100 * n + i, description='Worker'))
+                queued.append((n, len(self.client.uncommitted)))
+            finally:
+                txn.abort()
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in (2, 3, 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(queued), [(2, 2), (3, 3), (4, 4)])
+        self.assertEqual(len(self.client.uncommitted), 1)
+        self.assertEqual(len(self.client._data_managers), 1)
+
+
+class TestHashCacheInFlight(TestCase):
+
+    def test_write_in_flight(self):
+        cache = LRUHashCache()
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests_txn',
+                               use_transaction=True,
+                               background=True,
+                               hash_cache=cache)
+        client.es = es = FakeBulkES(status=200)
+        todo = Todo(id=1, description='X')
+        with transaction.manager:
+            client.index_object(todo)
+        client.indexer.join()
+
+        es.release.clear()
+        todo.description = 'Y'
+        with transaction.manager:
+            client.index_object(todo)
+        # Writing the previously sent document again, while the other write
+        # is still being sent, must not be skipped.
+        todo.description = 'X'
+        with transaction.manager:
+            client.index_object(todo)
+        es.release.set()
+        client.indexer.join()
+        client.indexer.shutdown()
+
+        docs = [json.loads(lines[1])['description'] for lines in es.bodies]
+        self.assertEqual(docs, ['X', 'Y', 'X'])
+        self.assertTrue(cache.check(('Todo', 1, None),
+                                    document_hash({'description': 'X'})))
+
+
+class TestEmptyCommit(TestCase):
+
+    def commit_nothing(self, **kwargs):
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests_txn',
+                               use_transaction=True, **kwargs)
+        client.es = FakeBulkES(status=200)
+        with transaction.manager:
+            # Joined to the transaction, but nothing is written.
+            join_transaction(client, client.transaction_manager)
+        return client
+
+    def test_sync(self):
+        client = self.commit_nothing()
+        self.assertEqual(client.es.bodies, [])
+
+    def test_background(self):
+        client = self.commit_nothing(background=True)
+        self.assertEqual(client.indexer.threads, [])
+        self.assertEqual(client.indexer.queue.qsize(), 0)
+
+
 class TestClient(TestCase):
 
     def setUp(self):
@@ -60,3 +283,65 @@ class TestClient(TestCase):
         result = q.execute()
         todos = [doc.description for doc in result]
         self.assertNotIn('Finish exhaustive test suite', todos)
+
+    def test_commit_many_documents(self):
+        todos = [Todo(id=i, description='Bulk item %d' % i)
+                 for i in range(1, 26)]
+
+        self.client.bulk_chunk_size = 10
+        with transaction.manager:
+            for todo in todos:
+                self.client.index_object(todo)
+        self.client.refresh()
+
+        q = self.client.query(Todo, q='bulk')
+        self.assertEqual(q.count(), 25)
+
+    def test_background_commit(self):
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests_txn',
+                               use_transaction=True,
+                               background=True)
+        todo = Todo(id=77, description='Indexed in the background')
+        with transaction.manager:
+            client.index_object(todo)
+        client.indexer.join()
+        client.refresh()
+
+        q = client.query(Todo, q='background')
+        self.assertEqual(q.count(), 1)
+        client.indexer.shutdown()
+
+    def test_spooled_commit(self):
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests_txn',
+                               use_transaction=True,
+                               spool_threshold=512)
+        with transaction.manager:
+            for i in range(200, 300):
+                client.index_object(Todo(id=i, description='Spooled item'))
+            self.assertGreater(client.uncommitted.spills, 0)
+        client.refresh()
+
+        q = client.query(Todo, q='spooled')
+        self.assertEqual(q.count(), 100)
+
+    def test_skip_unchanged_commit(self):
+        cache = LRUHashCache()
+        client = ElasticClient(servers=['localhost:9200'],
+                               index='pyramid_es_tests_txn',
+                               use_transaction=True,
+                               hash_cache=cache)
+        todo = Todo(id=88, description='Hashed item')
+        with transaction.manager:
+            client.index_object(todo)
+        self.assertIn(('Todo', 88, None), cache.hashes)
+
+        with transaction.manager:
+            client.index_object(todo)
+            self.assertEqual(len(client.uncommitted), 0)
+        self.assertEqual(cache.skipped, 1)
+
+        with transaction.manager:
+            client.delete_object(todo)
+        self.assertNotIn(('Todo', 88, None), cache.hashes)
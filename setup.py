@@ -35,6 +35,10 @@ setup(name='pyramid_es',
       ],
       license='MIT',
       packages=find_packages(),
+      entry_points="""\
+      [console_scripts]
+      pyramid_es_reindex = pyramid_es.scripts.reindex:main
+      """,
       test_suite='nose.collector',
       tests_require=['nose'],
       zip_safe=False)